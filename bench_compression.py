@@ -0,0 +1,140 @@
+"""Benchmark of compressed message content over a scraped archive.
+
+Compares plain storage with per-message compression, without and with a
+trained dictionary, for each available codec: size of the contents and of
+the messages table once in SQLite, compression (write) and decompression
+(read) time.
+
+    python bench_compression.py forum_data.db
+    python bench_compression.py forum_data.db --output bench.json
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import zlib
+
+import message_codec
+
+
+class PlainCodec:
+    """Reference: contents stored as text"""
+
+    def compress(self, content):
+        return content
+
+    def decompress(self, content):
+        return content
+
+
+class NoDictCodec:
+    """Each message compressed on its own, without a dictionary"""
+
+    def __init__(self, codec):
+        self.codec = codec
+        if codec == "zstd":
+            self.compressor = message_codec.zstandard.ZstdCompressor(level=message_codec.ZSTD_LEVEL)
+            self.decompressor = message_codec.zstandard.ZstdDecompressor()
+
+    def compress(self, content):
+        if self.codec == "zstd":
+            return self.compressor.compress(content.encode("utf-8"))
+        return zlib.compress(content.encode("utf-8"), message_codec.ZLIB_LEVEL)
+
+    def decompress(self, blob):
+        if self.codec == "zstd":
+            return self.decompressor.decompress(blob).decode("utf-8")
+        return zlib.decompress(blob).decode("utf-8")
+
+
+def load_contents(db_path):
+    """Plain contents of every message of the archive"""
+    conn = sqlite3.connect(db_path)
+    decoder = message_codec.MessageDecoder(conn)
+    if conn.execute("SELECT 1 FROM pragma_table_info('messages') WHERE name = 'content_dict_id'").fetchone():
+        rows = conn.execute("SELECT content, content_dict_id FROM messages ORDER BY id")
+    else:
+        rows = conn.execute("SELECT content, NULL FROM messages ORDER BY id")
+    contents = [decoder.decode(content, dict_id) or "" for content, dict_id in rows]
+    conn.close()
+    return contents
+
+
+def table_size(values):
+    """Size in bytes of a SQLite messages table holding values"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY, content)")
+        conn.executemany("INSERT INTO messages (content) VALUES (?)", ((value,) for value in values))
+        conn.commit()
+        conn.execute("VACUUM")
+        conn.close()
+        return os.path.getsize(path)
+
+
+def measure(codec, contents):
+    start = time.perf_counter()
+    stored = [codec.compress(content) for content in contents]
+    write = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = [codec.decompress(value) for value in stored]
+    read = time.perf_counter() - start
+
+    if decoded != contents:
+        raise AssertionError(f"{type(codec).__name__} doesn't round-trip")
+    return {
+        "content_kb": sum(len(value if isinstance(value, bytes) else value.encode("utf-8"))
+                          for value in stored) / 1024,
+        "table_kb": table_size(stored) / 1024,
+        "write_us_per_message": write / len(contents) * 1e6,
+        "read_us_per_message": read / len(contents) * 1e6,
+    }
+
+
+def run(args):
+    contents = load_contents(args.db)
+    if not contents:
+        raise SystemExit(f"No messages in {args.db}")
+    print(f"{len(contents)} messages, {sum(len(c.encode('utf-8')) for c in contents) / 1024:.0f} KB of text")
+
+    codecs = [("plain", PlainCodec())]
+    step = max(len(contents) // args.samples, 1)
+    samples = [content for content in contents[::step] if content]
+    for name in ["zlib", "zstd"]:
+        if name == "zstd" and message_codec.zstandard is None:
+            print("zstandard not installed, skipping zstd")
+            continue
+        codecs.append((name, NoDictCodec(name)))
+        start = time.perf_counter()
+        trained, data = message_codec.train_dictionary(samples, name)
+        print(f"Trained {trained} dictionary of {len(data)} bytes in {time.perf_counter() - start:.1f}s")
+        codecs.append((f"{trained}+dict", message_codec.MessageCodec(trained, data)))
+
+    results = {}
+    for name, codec in codecs:
+        results[name] = measure(codec, contents)
+
+    plain = results["plain"]
+    print(f"{'storage':<12} {'content KB':>11} {'table KB':>10} {'ratio':>6} {'write us':>9} {'read us':>8}")
+    for name, stats in results.items():
+        print(f"{name:<12} {stats['content_kb']:>11.0f} {stats['table_kb']:>10.0f}"
+              f" {plain['table_kb'] / stats['table_kb']:>5.2f}x"
+              f" {stats['write_us_per_message']:>9.1f} {stats['read_us_per_message']:>8.1f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db", nargs="?", default="forum_data.db")
+    parser.add_argument("--samples", type=int, default=message_codec.DICT_SAMPLE_MESSAGES,
+                        help="messages the dictionaries are trained on")
+    parser.add_argument("--output", help="save the results as JSON")
+    run(parser.parse_args())
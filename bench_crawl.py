@@ -0,0 +1,168 @@
+"""End-to-end crawl benchmark against a local synthetic free-bb forum.
+
+Starts fake_freebb_server.py with the given scale, latency and injected
+errors, crawls it from scratch with free-bb-scrapper.py into a temporary
+database, then reports the throughput of the whole crawl (HTTP requests,
+posts and database rows per second) and checks every generated post was
+stored.
+
+    python bench_crawl.py --forums 5 --threads 200 --latency 0.05
+    python bench_crawl.py --mode async --concurrency 32 --error-rate 0.02 --output crawl.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from bench_parsing import load_scraper
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_freebb_server.py")
+
+# Scraper settings of each crawl mode
+MODES = {
+    "sequential": {},
+    "async": {"ASYNC_CRAWL": True},
+    "priority": {"PRIORITY_CRAWL": True},
+    "resumable": {"RESUMABLE_CRAWL": True},
+}
+
+
+def start_server(args):
+    """Run the fake forum in a process of its own, returning it and its URL"""
+    command = [
+        sys.executable, SERVER_PATH, "--port", "0",
+        "--forums", str(args.forums), "--threads", str(args.threads), "--max-posts", str(args.max_posts),
+        "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--error-rate", str(args.error_rate), "--throttle-rate", str(args.throttle_rate),
+        "--drop-rate", str(args.drop_rate), "--session-pages", str(args.session_pages),
+    ]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    first_line = server.stdout.readline().split()
+    if not first_line or first_line[0] != "Serving":
+        server.kill()
+        raise SystemExit("The fake forum server didn't start")
+    return server, first_line[1]
+
+
+def server_stats(base_url):
+    with urllib.request.urlopen(f"{base_url}/_stats") as r:
+        return json.load(r)
+
+
+def configure(scraper, args):
+    """Apply the crawl mode and concurrency to the loaded scraper"""
+    for name, value in MODES[args.mode].items():
+        setattr(scraper, name, value)
+    scraper.CRAWL_CONCURRENCY = args.concurrency
+    scraper.PAGE_WORKERS = args.concurrency
+    scraper.THROTTLE_MAX_CONCURRENCY = args.concurrency
+    scraper.POOL_SIZE = args.concurrency
+    scraper.PARTIAL_PARSING = args.partial_parsing
+    scraper.COMPRESS_CONTENT = args.compress
+
+
+def count_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    counts = {
+        table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ["forums", "threads", "messages"]
+    }
+    conn.close()
+    return counts
+
+
+def run(args):
+    server, base_url = start_server(args)
+    try:
+        with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+                scraper = load_scraper()
+                configure(scraper, args)
+                db_path = os.path.join(tmp, "bench.db")
+                site = scraper.Site(base_url, "bench", "bench", db_path, os.path.join(tmp, "session.txt"))
+                scraper.init_database(db_path)
+                scraper.metrics.reset()
+
+                start = time.perf_counter()
+                scraper.crawl_site(site)
+                elapsed = time.perf_counter() - start
+
+            rows = count_rows(db_path)
+        if scraper.parse_pool is not None:
+            scraper.parse_pool.shutdown()
+        stats = server_stats(base_url)
+    finally:
+        server.terminate()
+        server.wait()
+
+    expected = stats["forum"]
+    requests = stats["requests"].get("total", 0)
+    counters = scraper.metrics.snapshot()["counters"]
+    results = {
+        "mode": args.mode,
+        "concurrency": args.concurrency,
+        "elapsed_seconds": elapsed,
+        "requests": requests,
+        "requests_per_second": requests / elapsed,
+        "posts": rows["messages"],
+        "posts_per_second": rows["messages"] / elapsed,
+        "db_rows": sum(rows.values()),
+        "db_rows_per_second": sum(rows.values()) / elapsed,
+        "rows": rows,
+        "expected": expected,
+        "server": stats["requests"],
+        "scraper": counters,
+    }
+
+    print(f"Crawled {expected['forums']} forums, {expected['threads']} threads and"
+          f" {expected['posts']} posts in {elapsed:.1f}s ({args.mode}, concurrency {args.concurrency})")
+    print(f"  requests: {requests} ({results['requests_per_second']:.1f}/s)")
+    print(f"  posts:    {rows['messages']} ({results['posts_per_second']:.1f}/s)")
+    print(f"  DB rows:  {results['db_rows']} ({results['db_rows_per_second']:.1f}/s)")
+    injected = {name: stats["requests"].get(name, 0) for name in ["errors", "throttled", "dropped", "logged_out"]}
+    if any(injected.values()):
+        print("  injected: " + ", ".join(f"{name} {count}" for name, count in injected.items() if count))
+    for name in ["http_retries", "logins", "scrape_errors", "site_errors"]:
+        if counters.get(name):
+            print(f"  {name}: {counters[name]}")
+
+    missing = {
+        table: expected[key] - rows[table]
+        for table, key in [("forums", "forums"), ("threads", "threads"), ("messages", "posts")]
+        if rows[table] != expected[key]
+    }
+    if missing:
+        print("  INCOMPLETE, missing: " + ", ".join(f"{table} {count}" for table, count in missing.items()))
+    results["complete"] = not missing
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=MODES, default="sequential")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight at most")
+    parser.add_argument("--partial-parsing", action="store_true")
+    parser.add_argument("--compress", action="store_true", help="store compressed message contents")
+    parser.add_argument("--forums", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=100, help="threads per forum")
+    parser.add_argument("--max-posts", type=int, default=60, help="posts of the longest threads")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 503 answers")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of 429 answers")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of connections cut")
+    parser.add_argument("--session-pages", type=int, default=0, help="pages before a login expires")
+    parser.add_argument("--verbose", action="store_true", help="show the scraper's output")
+    parser.add_argument("--output", help="save the results as JSON")
+    run(parser.parse_args())
@@ -0,0 +1,247 @@
+"""Offline parsing benchmark over recorded free-bb pages.
+
+Fixtures live in bench_fixtures/ as <kind>-<variant>.html, kind being
+"forums" (forum index), "threads" (a forum's thread list) or "messages"
+(a thread page). The committed ones are synthetic, written by:
+
+    python bench_parsing.py generate
+
+Pages of a real forum can be recorded from the page cache of a crawl, e.g.:
+
+    python bench_parsing.py record messages huge http://foo.free-bb.com/sujet-...html
+
+Then run the benchmark, save the results and compare them with another commit:
+
+    python bench_parsing.py run --output bench.json
+    python bench_parsing.py run --compare bench.json
+"""
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import subprocess
+import time
+import tracemalloc
+
+import fake_freebb_server
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_fixtures")
+
+# Parser settings benchmarked; the first one is the reference for the extracted data
+BACKENDS = [
+    ("html.parser", False),
+    ("html.parser", True),
+    ("lxml", False),
+    ("lxml", True),
+]
+
+
+# A sponsored links row of a thread page, which takes a post slot like a post
+AD_ROW = (
+    '<div class="row topPost"><div class="author"></div><div class="calendar"></div></div>'
+    '<div class="row"><div class="col-md-9">Liens sponsorisés<ins class="adsbygoogle"></ins>'
+    '<script>var google_ad_client = "ca-pub-0";</script></div></div>'
+)
+
+
+class HugePostsForum(fake_freebb_server.SyntheticForum):
+    """Synthetic forum whose posts are very long, like posts full of quotes"""
+
+    def content(self, thread_id, number):
+        return " ".join(super(HugePostsForum, self).content(thread_id, number * 100 + part) for part in range(40))
+
+
+def load_scraper():
+    """Import free-bb-scrapper.py, which can't be imported by name"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "free-bb-scrapper.py")
+    spec = importlib.util.spec_from_file_location("free_bb_scrapper", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def parse_functions(scraper):
+    """Parse step of each scraping function, from raw HTML to extracted records"""
+    def forums(html):
+        return scraper.parse_forums(scraper.make_soup(html, "forums"))
+
+    def threads(html):
+        return scraper.collect_threads([scraper.parse_thread_list_page(html)])
+
+    def messages(html):
+        return scraper.collect_messages("fixture", [scraper.parse_thread_page(html)])
+
+    def max_pages(html):
+        # get_max_pages only needs the pagination, present on thread pages
+        return [scraper.get_max_pages(scraper.make_soup(html, "messages"))]
+
+    return {
+        "get_forums": ("forums", forums),
+        "get_threads": ("threads", threads),
+        "get_messages": ("messages", messages),
+        "get_max_pages": ("messages", max_pages),
+    }
+
+
+def load_fixtures():
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.html"))):
+        name = os.path.basename(path)[:-len(".html")]
+        kind, _, variant = name.partition("-")
+        with open(path, encoding="utf-8") as f:
+            fixtures.setdefault(kind, []).append((variant, f.read()))
+    return fixtures
+
+
+def measure(parse, html, min_time):
+    """Parse a page repeatedly for at least min_time seconds"""
+    # Peak memory of a single parse
+    tracemalloc.start()
+    records = parse(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        parse(html)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+
+    return records, {
+        "pages_per_sec": runs / elapsed,
+        "records_per_sec": runs * len(records) / elapsed,
+        "records": len(records),
+        "peak_memory_kb": peak / 1024,
+        "size_kb": len(html.encode("utf-8")) / 1024,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    scraper = load_scraper()
+    fixtures = load_fixtures()
+    if not fixtures:
+        print(f"No fixtures found in {FIXTURES_DIR}, record some first (see --help)")
+        return
+
+    results = {"revision": git_revision(), "benchmarks": {}}
+    for func_name, (kind, parse) in parse_functions(scraper).items():
+        for variant, html in fixtures.get(kind, []):
+            reference = None
+            for backend, partial in BACKENDS:
+                if backend not in args.backends:
+                    continue
+                scraper.PARSER_BACKEND = backend
+                scraper.PARTIAL_PARSING = partial
+                records, stats = measure(parse, html, args.min_time)
+
+                # Every backend must extract exactly the same data
+                if reference is None:
+                    reference = records
+                stats["identical"] = records == reference
+
+                key = f"{func_name}/{variant}/{backend}{'+partial' if partial else ''}"
+                results["benchmarks"][key] = stats
+
+    print_results(results, load_results(args.compare) if args.compare else None)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+
+def load_results(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def print_results(results, baseline=None):
+    print(f"Revision: {results['revision']}")
+    if baseline:
+        print(f"Compared with: {baseline['revision']}")
+    print(f"{'benchmark':<50} {'pages/s':>9} {'records/s':>11} {'peak KB':>9} {'same':>5}"
+          + (f" {'speedup':>8}" if baseline else ""))
+    for key, stats in results["benchmarks"].items():
+        line = (f"{key:<50} {stats['pages_per_sec']:>9.1f} {stats['records_per_sec']:>11.0f}"
+                f" {stats['peak_memory_kb']:>9.0f} {'yes' if stats['identical'] else 'NO':>5}")
+        if baseline:
+            old = baseline["benchmarks"].get(key)
+            line += f" {stats['pages_per_sec'] / old['pages_per_sec']:>7.2f}x" if old else f" {'-':>8}"
+        print(line)
+
+
+def generate(args):
+    """Write synthetic fixtures, built by the fake forum server"""
+    forum = fake_freebb_server.SyntheticForum(forums=12, threads_per_forum=50, seed=args.seed)
+    threads = range(1, len(forum.post_counts) + 1)
+    short_thread = next(t for t in threads if 3 <= forum.post_counts[t - 1] <= 8)
+    # The longest thread, whose first page is full and paginated
+    long_thread = max(threads, key=lambda t: forum.post_counts[t - 1])
+    long_page = fake_freebb_server.thread_page(forum, long_thread, 1)
+    fixtures = {
+        "forums-small": fake_freebb_server.index_page(forum),
+        "threads-small": fake_freebb_server.thread_list_page(forum, 1, 1),
+        "messages-small": fake_freebb_server.thread_page(forum, short_thread, 1),
+        "messages-huge": fake_freebb_server.thread_page(
+            HugePostsForum(forums=12, threads_per_forum=50, seed=args.seed), long_thread, 1
+        ),
+        # An ad before every reply
+        "messages-ads": long_page.replace('<div class="row topPost">', AD_ROW + '<div class="row topPost">'),
+    }
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for name, html in fixtures.items():
+        path = os.path.join(FIXTURES_DIR, f"{name}.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(html)
+        print(f"Saved {path} ({len(html) // 1024} KiB)")
+
+
+def record(args):
+    """Save a page from the crawl's page cache as a fixture"""
+    scraper = load_scraper()
+    cached = scraper.PageCache(args.cache_dir).get(args.url)
+    if cached is None:
+        raise SystemExit(f"Page not in cache: {args.url}")
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    path = os.path.join(FIXTURES_DIR, f"{args.kind}-{args.variant}.html")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(cached["html"])
+    print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="benchmark the parse functions over the fixtures")
+    run_parser.add_argument("--min-time", type=float, default=1.0, help="seconds spent on each benchmark")
+    run_parser.add_argument("--backends", nargs="+", default=["html.parser", "lxml"])
+    run_parser.add_argument("--output", help="save the results as JSON")
+    run_parser.add_argument("--compare", help="JSON results of another revision to compare with")
+    run_parser.set_defaults(func=run)
+
+    generate_parser = commands.add_parser("generate", help="write synthetic fixtures from the fake forum")
+    generate_parser.add_argument("--seed", type=int, default=fake_freebb_server.SEED)
+    generate_parser.set_defaults(func=generate)
+
+    record_parser = commands.add_parser("record", help="save a cached page as a fixture")
+    record_parser.add_argument("kind", choices=["forums", "threads", "messages"])
+    record_parser.add_argument("variant", help="e.g. small, huge, ads")
+    record_parser.add_argument("url")
+    record_parser.add_argument("--cache-dir", default="page_cache")
+    record_parser.set_defaults(func=record)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,414 @@
+"""Local stand-in for a free-bb forum, to test and load-test the scraper.
+
+Serves a synthetic forum shaped like free-bb: a login form with a CSRF token,
+the forum index (div.containerGroup), thread lists (liste-...html) and thread
+pages (sujet-...html), both paginated with ul.pagination. Its content is
+generated from a seed, so every run with the same options serves the same
+forum. Latency, errors and session expiry can be injected:
+
+    python fake_freebb_server.py --port 8000 --forums 10 --threads 500
+    python fake_freebb_server.py --latency 0.05 --jitter 0.05 --error-rate 0.02
+
+Then crawl http://127.0.0.1:8000 with any username and password. GET /_stats
+returns the requests served so far and the size of the generated forum.
+bench_crawl.py runs a whole crawl against it.
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+FORUMS = 5
+THREADS_PER_FORUM = 100
+MAX_POSTS = 60          # posts of the longest threads
+MEMBERS = 200
+STICKY_THREADS = 1      # threads listed again at the top of every list page
+SEED = 1
+
+# Pagination of the real forums, which POSTS_PER_PAGE of the scraper matches
+POSTS_PER_PAGE = 15
+THREADS_PER_PAGE = 20
+
+FIRST_POST_DATE = datetime(2012, 3, 12, 14, 0)
+
+MONTHS = ["janvier", "février", "mars", "avril", "mai", "juin", "juillet",
+          "août", "septembre", "octobre", "novembre", "décembre"]
+SHORT_MONTHS = ["Jan", "Fév", "Mar", "Avr", "Mai", "Juin", "Juil", "Aoû", "Sep", "Oct", "Nov", "Déc"]
+DAYS = ["Lun", "Mar", "Mer", "Jeu", "Ven", "Sam", "Dim"]
+WORDS = (
+    "bonjour merci club sortie samedi dimanche réunion assemblée générale photos voyage "
+    "moto voiture vélo randonnée rendez-vous parking heure matin soir week-end question "
+    "réponse problème solution idée super génial pas de souci à bientôt amicalement "
+    "le la les un une des et ou mais donc car pour avec sans sur sous dans chez très "
+    "bien aussi encore toujours jamais peut-être demain hier aujourd'hui prochain"
+).split()
+
+
+def french_date(date):
+    """Post date as shown on thread pages: "12 mars 2012 - 14:00" """
+    return f"{date.day} {MONTHS[date.month - 1]} {date.year} - {date:%H:%M}"
+
+
+def short_french_date(date):
+    """Last post date as shown on thread lists: "Lun 12 Mar 2012 - 14:35" """
+    return f"{DAYS[date.weekday()]} {date.day} {SHORT_MONTHS[date.month - 1]} {date.year} - {date:%H:%M}"
+
+
+def thousands(number):
+    return f"{number:,}".replace(",", "\xa0")
+
+
+class SyntheticForum:
+    """The forums, threads and posts served, generated from a seed.
+
+    Thread ids run from 1 across all forums. Only the number of posts of each
+    thread is kept in memory, posts are generated when their page is served.
+    """
+
+    def __init__(self, forums=FORUMS, threads_per_forum=THREADS_PER_FORUM, max_posts=MAX_POSTS, seed=SEED):
+        self.forums = forums
+        self.threads_per_forum = threads_per_forum
+        self.seed = seed
+        rng = random.Random(seed)
+        # Mostly short threads and a few long ones, like real forums
+        self.post_counts = [
+            min(int(rng.paretovariate(1.2)), max_posts)
+            for _ in range(forums * threads_per_forum)
+        ]
+
+    def stats(self):
+        return {
+            "forums": self.forums,
+            "threads": len(self.post_counts),
+            "posts": sum(self.post_counts),
+        }
+
+    def forum_threads(self, forum_id):
+        first = (forum_id - 1) * self.threads_per_forum + 1
+        return range(first, first + self.threads_per_forum)
+
+    def forum_url(self, forum_id, page=1):
+        return f"/liste-{forum_id}-{forum_id * 7}-{page}-forum-{forum_id}.html"
+
+    def thread_url(self, thread_id, page=1):
+        forum_id = (thread_id - 1) // self.threads_per_forum + 1
+        return f"/sujet-{thread_id}-{forum_id}-1-{page}-sujet-{thread_id}.html"
+
+    def post_date(self, thread_id, number):
+        return FIRST_POST_DATE + timedelta(hours=thread_id, minutes=7 * number)
+
+    def author(self, thread_id, number):
+        rng = random.Random(f"{self.seed}:{thread_id}:{number}:author")
+        return f"membre{rng.randint(1, MEMBERS)}"
+
+    def content(self, thread_id, number):
+        rng = random.Random(f"{self.seed}:{thread_id}:{number}")
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 120)))
+        return f"{text.capitalize()}. Message {number} du sujet {thread_id}."
+
+    def thread(self, thread_id):
+        """Row of a thread on its forum's list"""
+        posts = self.post_counts[thread_id - 1]
+        return {
+            "id": thread_id,
+            "title": f"Sujet {thread_id}",
+            "author": self.author(thread_id, 1),
+            "replies": posts - 1,
+            "views": posts * 20 + thread_id % 50,
+            "last_date": short_french_date(self.post_date(thread_id, posts)),
+            "last_author": self.author(thread_id, posts),
+        }
+
+
+def pagination(page, pages):
+    """free-bb pagination: first pages, last page and next link"""
+    if pages <= 1:
+        return ""
+    numbers = sorted({1, 2, 3, page, pages} & set(range(1, pages + 1)))
+    items = "".join(
+        f'<li class="active"><span>{n}</span></li>' if n == page else f'<li><a href="#">{n}</a></li>'
+        for n in numbers
+    )
+    if page < pages:
+        items += '<li><a href="#">Suivant</a></li>'
+    return f'<ul class="pagination">{items}</ul>'
+
+
+def layout(title, body):
+    """Page chrome around the part the scraper reads"""
+    return (
+        '<!DOCTYPE html><html lang="fr"><head><meta charset="utf-8">'
+        f'<title>{title}</title><link rel="stylesheet" href="/css/style.css"></head><body>'
+        '<nav class="navbar"><ul><li><a href="/">Accueil</a></li><li><a href="/search">Rechercher</a></li>'
+        '<li><a href="/members">Membres</a></li></ul></nav>'
+        f'<div class="container"><h1>{title}</h1>{body}</div>'
+        '<aside class="sidebar"><script>var google_ad_client = "ca-pub-0";</script></aside>'
+        '<footer>Forum gratuit free-bb</footer></body></html>'
+    )
+
+
+def login_page(csrf_token):
+    return layout("Connexion", (
+        '<form method="post" action="/login_check">'
+        '<input name="_username" type="text"><input name="_password" type="password">'
+        f'<input name="_csrf_token" type="hidden" value="{csrf_token}">'
+        '<input name="_remember_me" type="checkbox"><input name="_submit" type="submit" value="Connexion">'
+        '</form>'
+    ))
+
+
+def index_page(forum):
+    groups = []
+    for group_start in range(1, forum.forums + 1, 3):
+        rows = []
+        for forum_id in range(group_start, min(group_start + 3, forum.forums + 1)):
+            threads = forum.forum_threads(forum_id)
+            replies = sum(forum.post_counts[t - 1] - 1 for t in threads)
+            rows.append(
+                '<div class="row forum-row catLink"><div class="col-md-7">'
+                f'<a class="categoryLink" href="{forum.forum_url(forum_id)}">Forum {forum_id}</a>'
+                f'<div class="forumdesc">Discussions du forum {forum_id}</div></div>'
+                f'<div class="col-md-1">{thousands(len(threads))} sujets {thousands(replies)} réponses</div>'
+                '</div>'
+            )
+        groups.append(f'<div class="containerGroup"><h4>Catégorie {group_start // 3 + 1}</h4>{"".join(rows)}</div>')
+    return layout("Index du forum", "".join(groups))
+
+
+def thread_list_page(forum, forum_id, page):
+    threads = forum.forum_threads(forum_id)
+    pages = max((len(threads) + THREADS_PER_PAGE - 1) // THREADS_PER_PAGE, 1)
+    start = threads.start + (page - 1) * THREADS_PER_PAGE
+    listed = range(start, min(start + THREADS_PER_PAGE, threads.stop))
+    if 1 < page <= pages:
+        listed = itertools.chain(threads[:STICKY_THREADS], listed)
+    rows = []
+    for thread_id in listed:
+        thread = forum.thread(thread_id)
+        rows.append(
+            '<div class="row forum-row"><div class="tclcon">'
+            f'<a href="{forum.thread_url(thread_id)}#num1">{thread["title"]}</a>'
+            f' par <a itemprop="author" href="#">{thread["author"]}</a></div>'
+            f'<div itemprop="interactionStatistic"><strong>{thread["replies"]}</strong> réponses'
+            f' <strong>{thread["views"]}</strong> vues</div>'
+            f'<div class="lastpostlink"><time>{thread["last_date"]}</time>'
+            f' <span class="byuser">par <a href="#">{thread["last_author"]}</a></span></div></div>'
+        )
+    return layout(f"Forum {forum_id}", "".join(rows) + pagination(page, pages))
+
+
+def thread_page(forum, thread_id, page):
+    posts = forum.post_counts[thread_id - 1]
+    pages = (posts + POSTS_PER_PAGE - 1) // POSTS_PER_PAGE
+    rows = []
+    for number in range((page - 1) * POSTS_PER_PAGE + 1, min(page * POSTS_PER_PAGE, posts) + 1):
+        content = forum.content(thread_id, number)
+        if number == 1:
+            classes = "row firstpost topPost"
+            body = f"{content}<script>trackView({thread_id})</script>"
+        else:
+            classes = "row topPost"
+            body = f'<div class="reply{thread_id * 1000 + number}">{content}</div>'
+        rows.append(
+            f'<div class="{classes}"><div class="author"><a href="#"><h4>{forum.author(thread_id, number)}</h4></a></div>'
+            f'<div class="calendar">{french_date(forum.post_date(thread_id, number))}</div></div>'
+            f'<div class="row"><div class="col-md-9">{body}</div><div class="col-md-3">Signature</div></div>'
+        )
+    return layout(f"Sujet {thread_id}", "".join(rows) + pagination(page, pages))
+
+
+class FakeForumServer(ThreadingHTTPServer):
+    """HTTP server of a SyntheticForum, with injected latency and errors.
+
+    Each request waits latency plus up to jitter seconds. Then error_rate of
+    them get a 503 with a Retry-After, throttle_rate a 429 and drop_rate are
+    cut without an answer. A login session expires after session_pages pages
+    (0: never), the next pages getting the login form as free-bb does.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, forum, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0,
+                 drop_rate=0.0, session_pages=0):
+        super().__init__(address, FakeForumHandler)
+        self.forum = forum
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.drop_rate = drop_rate
+        self.session_pages = session_pages
+        self.csrf_token = secrets.token_hex(16)
+        self.sessions = {}      # session id -> pages left (None: unlimited)
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {"requests": dict(self.counters), "forum": self.forum.stats()}
+
+    def open_session(self):
+        session_id = secrets.token_hex(16)
+        with self.lock:
+            self.sessions[session_id] = self.session_pages or None
+        return session_id
+
+    def use_session(self, session_id):
+        """Count a page against a session, False if it doesn't exist or expired"""
+        with self.lock:
+            if session_id not in self.sessions:
+                return False
+            pages_left = self.sessions[session_id]
+            if pages_left is None:
+                return True
+            if pages_left <= 0:
+                return False
+            self.sessions[session_id] = pages_left - 1
+            return True
+
+
+class FakeForumHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes: with Nagle's algorithm, the
+    # body would wait for the client's delayed ACK (~40 ms a request)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_page(self, html, status=200, headers=(), content_type="text/html; charset=utf-8"):
+        body = html.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def inject_faults(self):
+        """Delay the request and maybe fail it, returning True if it was answered"""
+        server = self.server
+        delay = server.latency + random.uniform(0, server.jitter)
+        if delay:
+            time.sleep(delay)
+        roll = random.random()
+        if roll < server.drop_rate:
+            server.count("dropped")
+            self.close_connection = True
+            return True
+        roll -= server.drop_rate
+        if roll < server.error_rate:
+            server.count("errors")
+            self.send_page("Service temporairement indisponible", 503, [("Retry-After", "1")])
+            return True
+        roll -= server.error_rate
+        if roll < server.throttle_rate:
+            server.count("throttled")
+            self.send_page("Trop de requêtes", 429)
+            return True
+        return False
+
+    def session_id(self):
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        return cookie["sid"].value if "sid" in cookie else None
+
+    def do_GET(self):
+        server = self.server
+        forum = server.forum
+        path = self.path.split("?")[0]
+        if path == "/_stats":
+            return self.send_page(json.dumps(server.stats()), content_type="application/json")
+
+        server.count("total")
+        if self.inject_faults():
+            return
+        if path == "/login":
+            server.count("login")
+            return self.send_page(login_page(server.csrf_token))
+        if not server.use_session(self.session_id()):
+            server.count("logged_out")
+            return self.send_page(login_page(server.csrf_token))
+
+        if path == "/":
+            server.count("index")
+            return self.send_page(index_page(forum))
+
+        match = re.fullmatch(r"/liste-(\d+)-\d+-(\d+)-[^/]*\.html", path)
+        if match and 1 <= int(match[1]) <= forum.forums:
+            server.count("thread_list")
+            return self.send_page(thread_list_page(forum, int(match[1]), int(match[2])))
+
+        match = re.fullmatch(r"/sujet-(\d+)-\d+-\d+-(\d+)-[^/]*\.html", path)
+        if match and 1 <= int(match[1]) <= len(forum.post_counts):
+            server.count("thread")
+            return self.send_page(thread_page(forum, int(match[1]), int(match[2])))
+
+        server.count("not_found")
+        self.send_page("Page introuvable", 404)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        server.count("total")
+        if self.path != "/login_check":
+            return self.send_page("Page introuvable", 404)
+
+        server.count("login_check")
+        if form.get("_csrf_token") != [server.csrf_token] or not form.get("_username"):
+            return self.send_page(login_page(server.csrf_token))
+        session_id = server.open_session()
+        self.send_page(layout("Connexion réussie", '<a href="/profile">Mon profil</a>'),
+                       headers=[("Set-Cookie", f"sid={session_id}; Path=/; HttpOnly")])
+
+
+def make_server(host="127.0.0.1", port=0, forums=FORUMS, threads=THREADS_PER_FORUM, max_posts=MAX_POSTS,
+                seed=SEED, **faults):
+    """Server of a new synthetic forum, on a free port by default"""
+    return FakeForumServer((host, port), SyntheticForum(forums, threads, max_posts, seed), **faults)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000, help="0 picks a free port")
+    parser.add_argument("--forums", type=int, default=FORUMS)
+    parser.add_argument("--threads", type=int, default=THREADS_PER_FORUM, help="threads per forum")
+    parser.add_argument("--max-posts", type=int, default=MAX_POSTS, help="posts of the longest threads")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 503 answers")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of 429 answers")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of connections cut")
+    parser.add_argument("--session-pages", type=int, default=0, help="pages before a login expires")
+    args = parser.parse_args()
+
+    server = make_server(
+        args.host, args.port, args.forums, args.threads, args.max_posts, args.seed,
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate, drop_rate=args.drop_rate, session_pages=args.session_pages,
+    )
+    host, port = server.server_address[:2]
+    stats = server.forum.stats()
+    # First line read by bench_crawl.py
+    print(f"Serving http://{host}:{port}", flush=True)
+    print(f"{stats['forums']} forums, {stats['threads']} threads, {stats['posts']} posts", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
@@ -0,0 +1,91 @@
+"""Parsing of the French dates displayed by free-bb forums.
+
+Posts and last posts show dates such as "12 mars 2012 - 14:00",
+"Lun 12 Mar 2012 - 14:35", "Mer 5 Juin - 8:40" (current year) or
+"Aujourd'hui à 14:35" / "Hier à 09:12", in the forum's time zone.
+"""
+import re
+import time
+import unicodedata
+from datetime import datetime, timedelta
+
+try:
+    from zoneinfo import ZoneInfo
+    FORUM_TIMEZONE = ZoneInfo("Europe/Paris")
+except Exception:  # no zoneinfo or no tz database
+    FORUM_TIMEZONE = None   # local time of this machine
+
+MONTHS = {
+    "jan": 1, "janv": 1, "janvier": 1,
+    "fev": 2, "fevr": 2, "fevrier": 2,
+    "mar": 3, "mars": 3,
+    "avr": 4, "avril": 4,
+    "mai": 5,
+    "juin": 6,
+    "juil": 7, "juillet": 7,
+    "aou": 8, "aout": 8,
+    "sep": 9, "sept": 9, "septembre": 9,
+    "oct": 10, "octobre": 10,
+    "nov": 11, "novembre": 11,
+    "dec": 12, "decembre": 12,
+}
+
+ABSOLUTE_DATE = re.compile(
+    r"(?P<day>\d{1,2})(?:er)?\s+(?P<month>[a-z]+)\.?(?:\s+(?P<year>\d{4}))?"
+    r"(?:\s*(?:-|,|a)?\s*(?P<hour>\d{1,2})[:h](?P<minute>\d{2}))?"
+)
+RELATIVE_DATE = re.compile(
+    r"(?P<day>aujourd'hui|hier)(?:\s*(?:-|,|a)?\s*(?P<hour>\d{1,2})[:h](?P<minute>\d{2}))?"
+)
+
+
+def normalize(text):
+    """Lower case text without accents"""
+    text = unicodedata.normalize("NFKD", text.lower().replace("’", "'"))
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def is_relative(text):
+    """Whether a date is relative to the day it was displayed ("Hier à 09:12")"""
+    return bool(text) and RELATIVE_DATE.search(normalize(text)) is not None
+
+
+def shows_year(text):
+    """Whether a date is displayed with its year, so it reads the same on any day"""
+    match = ABSOLUTE_DATE.search(normalize(text)) if text else None
+    return match is not None and match["month"] in MONTHS and match["year"] is not None
+
+
+def parse_forum_date(text, now=None):
+    """Unix timestamp of a date displayed by the forum, or None if it can't be read.
+
+    now (a timestamp, the current time by default) is the reference for
+    relative dates and dates shown without a year.
+    """
+    if not text:
+        return None
+    text = normalize(text)
+    today = datetime.fromtimestamp(now if now is not None else time.time(), FORUM_TIMEZONE)
+
+    match = RELATIVE_DATE.search(text)
+    if match:
+        day = today.date() - timedelta(days=1 if match["day"] == "hier" else 0)
+        year, month, day = day.year, day.month, day.day
+    else:
+        match = ABSOLUTE_DATE.search(text)
+        if not match or match["month"] not in MONTHS:
+            return None
+        month = MONTHS[match["month"]]
+        day = int(match["day"])
+        year = int(match["year"]) if match["year"] else today.year
+
+    hour = int(match["hour"]) if match["hour"] else 0
+    minute = int(match["minute"]) if match["minute"] else 0
+    try:
+        date = datetime(year, month, day, hour, minute, tzinfo=FORUM_TIMEZONE)
+        # Without a year, the date is the latest one not in the future
+        if not (match.re is ABSOLUTE_DATE and match["year"]) and date > today + timedelta(days=1):
+            date = date.replace(year=year - 1)
+    except ValueError:  # e.g. 29 February of the previous year
+        return None
+    return int(date.timestamp())
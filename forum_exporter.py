@@ -0,0 +1,228 @@
+"""Columnar export of the scraped forums, threads and messages.
+
+Tables are streamed from forum_data.db into Parquet files, in a layout any
+Arrow/Parquet reader (pyarrow.dataset, pandas, DuckDB, Spark) reads with
+partition pruning:
+
+    export/forums/part-00001-0.parquet
+    export/threads/forum_id=3/part-00001-0.parquet
+    export/messages/forum_id=3/month=2012-03/part-00001-0.parquet
+
+Each export only writes the rows added since the previous one, as new part
+files; export/_export_state.json remembers where it stopped. Delete the
+export directory to start over. Needs pyarrow (pip install pyarrow).
+
+    python forum_exporter.py --db forum_data.db --output export
+"""
+import argparse
+import collections
+import json
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+from message_codec import MessageDecoder
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+DB_NAME = "forum_data.db"
+EXPORT_DIR = "export"
+STATE_FILE = "_export_state.json"
+BATCH_ROWS = 10000      # rows read and held in memory at once
+MAX_OPEN_FILES = 64     # partition files written at once
+COMPRESSION = "zstd"
+
+UNKNOWN_MONTH = "unknown"
+
+
+def schemas():
+    return {
+        "forums": pa.schema([
+            ("id", pa.int64()),
+            ("group_name", pa.string()),
+            ("title", pa.string()),
+            ("description", pa.string()),
+            ("url", pa.string()),
+            ("subjects", pa.int64()),
+            ("replies", pa.int64()),
+        ]),
+        "threads": pa.schema([
+            ("id", pa.int64()),
+            ("title", pa.string()),
+            ("url", pa.string()),
+            ("author", pa.string()),
+            ("replies", pa.int64()),
+            ("views", pa.int64()),
+            ("last_date", pa.string()),
+            ("last_author", pa.string()),
+            ("last_time", pa.timestamp("s", tz="UTC")),
+        ]),
+        "messages": pa.schema([
+            ("id", pa.int64()),
+            ("thread_id", pa.int64()),
+            ("author", pa.string()),
+            ("content", pa.string()),
+            ("post_date", pa.string()),
+            ("post_number", pa.int64()),
+            ("post_time", pa.timestamp("s", tz="UTC")),
+        ]),
+    }
+
+
+def to_datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc) if timestamp is not None else None
+
+
+def month_of(timestamp):
+    return to_datetime(timestamp).strftime("%Y-%m") if timestamp is not None else UNKNOWN_MONTH
+
+
+def forum_rows(conn, last_id):
+    """(partition, row) of the forums added after last_id"""
+    cursor = conn.execute('''
+        SELECT id, group_name, title, description, url, subjects, replies
+        FROM forums WHERE id > ? ORDER BY id
+    ''', (last_id,))
+    columns = [name for name, *_ in cursor.description]
+    for row in cursor:
+        yield (), dict(zip(columns, row))
+
+
+def thread_rows(conn, last_id):
+    """(partition, row) of the threads added after last_id"""
+    cursor = conn.execute('''
+        SELECT id, forum_id, title, url, author, replies, views, last_date, last_author, last_ts
+        FROM threads WHERE id > ? ORDER BY id
+    ''', (last_id,))
+    columns = [name for name, *_ in cursor.description]
+    for row in cursor:
+        row = dict(zip(columns, row))
+        row["last_time"] = to_datetime(row.pop("last_ts"))
+        yield (("forum_id", row.pop("forum_id")),), row
+
+
+def message_rows(conn, last_id):
+    """(partition, row) of the messages added after last_id, with their content decoded"""
+    decoder = MessageDecoder(conn)
+    cursor = conn.execute('''
+        SELECT m.id, t.forum_id, m.thread_id, m.author, m.content, m.content_dict_id,
+               m.post_date, m.post_number, m.post_ts
+        FROM messages m JOIN threads t ON t.id = m.thread_id
+        WHERE m.id > ? ORDER BY m.id
+    ''', (last_id,))
+    columns = [name for name, *_ in cursor.description]
+    for row in cursor:
+        row = dict(zip(columns, row))
+        row["content"] = decoder.decode(row["content"], row.pop("content_dict_id"))
+        timestamp = row.pop("post_ts")
+        row["post_time"] = to_datetime(timestamp)
+        yield (("forum_id", row.pop("forum_id")), ("month", month_of(timestamp))), row
+
+
+class PartitionedWriter:
+    """Writes rows of a table to one Parquet file per partition.
+
+    Rows are buffered up to BATCH_ROWS in all, then written as a row group of
+    each partition's file. At most MAX_OPEN_FILES files are kept open: the
+    least recently written one is closed, and a later row of its partition
+    starts a new part file.
+    """
+
+    def __init__(self, directory, schema, export_number):
+        self.directory = directory
+        self.schema = schema
+        self.export_number = export_number
+        self.buffers = collections.defaultdict(list)
+        self.buffered = 0
+        self.writers = collections.OrderedDict()
+        self.parts = collections.Counter()
+        self.files = 0
+        self.rows = 0
+
+    def write(self, partition, row):
+        self.buffers[partition].append(row)
+        self.buffered += 1
+        if self.buffered >= BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        for partition, rows in self.buffers.items():
+            writer = self.writers.pop(partition, None) or self.open(partition)
+            self.writers[partition] = writer
+            writer.write_table(pa.Table.from_pylist(rows, schema=self.schema))
+            self.rows += len(rows)
+            while len(self.writers) > MAX_OPEN_FILES:
+                self.writers.popitem(last=False)[1].close()
+        self.buffers.clear()
+        self.buffered = 0
+
+    def open(self, partition):
+        directory = os.path.join(self.directory, *(f"{key}={value}" for key, value in partition))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{self.export_number:05d}-{self.parts[partition]}.parquet")
+        self.parts[partition] += 1
+        self.files += 1
+        return pq.ParquetWriter(path, self.schema, compression=COMPRESSION)
+
+    def close(self):
+        self.flush()
+        for writer in self.writers.values():
+            writer.close()
+        self.writers.clear()
+
+
+def load_state(output):
+    path = os.path.join(output, STATE_FILE)
+    if not os.path.exists(path):
+        return {"exports": 0, "last_ids": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(output, state):
+    path = os.path.join(output, STATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def export(db_path=DB_NAME, output=EXPORT_DIR):
+    """Export the rows added since the last export, returning how many per table"""
+    if pa is None:
+        raise SystemExit("The export needs pyarrow: pip install pyarrow")
+    conn = sqlite3.connect(db_path)
+    os.makedirs(output, exist_ok=True)
+    state = load_state(output)
+    export_number = state["exports"] + 1
+    last_ids = dict(state["last_ids"])
+    exported = {}
+
+    for table, rows in [("forums", forum_rows), ("threads", thread_rows), ("messages", message_rows)]:
+        # Rows added while exporting are left for the next export
+        max_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+        writer = PartitionedWriter(os.path.join(output, table), schemas()[table], export_number)
+        for partition, row in rows(conn, last_ids.get(table, 0)):
+            if row["id"] > max_id:
+                break
+            writer.write(partition, row)
+        writer.close()
+        last_ids[table] = max(max_id, last_ids.get(table, 0))
+        exported[table] = writer.rows
+        print(f"{table}: {writer.rows} rows in {writer.files} files")
+
+    # Only remember the export once all its files are complete
+    save_state(output, {"exports": export_number, "last_ids": last_ids})
+    conn.close()
+    return exported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DB_NAME)
+    parser.add_argument("--output", default=EXPORT_DIR)
+    args = parser.parse_args()
+    export(args.db, args.output)
@@ -5,6 +5,9 @@ import asyncio
 from datetime import datetime
 import logging
 import re
+import time
+
+from message_codec import MessageDecoder
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO)
@@ -23,11 +26,136 @@ intents.guild_messages = True
 # Création du bot
 bot = commands.Bot(command_prefix='!', intents=intents)
 
+class PublishState:
+    """État de la publication sur un serveur Discord (tables discord_* de la base)
+
+    Associe les forums, threads et messages publiés à leurs canaux, threads et
+    messages Discord. Chaque publication est enregistrée dès qu'elle est faite :
+    une publication interrompue reprend où elle s'était arrêtée, et les
+    suivantes ne publient que les nouveaux messages.
+    """
+
+    def __init__(self, db_path, guild_id):
+        self.conn = sqlite3.connect(db_path)
+        self.guild_id = guild_id
+
+    def channel_id(self, forum_id):
+        row = self.conn.execute(
+            "SELECT channel_id FROM discord_forums WHERE guild_id = ? AND forum_id = ?",
+            (self.guild_id, forum_id),
+        ).fetchone()
+        return row[0] if row else None
+
+    def discord_thread_id(self, thread_id):
+        row = self.conn.execute(
+            "SELECT discord_thread_id FROM discord_threads WHERE guild_id = ? AND thread_id = ?",
+            (self.guild_id, thread_id),
+        ).fetchone()
+        return row[0] if row else None
+
+    def save_forum(self, forum_id, channel_id):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO discord_forums (guild_id, forum_id, channel_id, published_at) VALUES (?, ?, ?, ?)",
+            (self.guild_id, forum_id, channel_id, time.time()),
+        )
+        self.conn.commit()
+
+    def save_thread(self, thread_id, channel_id, discord_thread_id):
+        self.conn.execute(
+            """INSERT OR REPLACE INTO discord_threads
+               (guild_id, thread_id, channel_id, discord_thread_id, published_at) VALUES (?, ?, ?, ?, ?)""",
+            (self.guild_id, thread_id, channel_id, discord_thread_id, time.time()),
+        )
+        self.conn.commit()
+
+    def save_message(self, message_id, discord_thread_id, discord_message_id, parts):
+        """Enregistre un message publié (discord_message_id None pour un message vide, pas posté)"""
+        self.conn.execute(
+            """INSERT OR REPLACE INTO discord_messages
+               (guild_id, message_id, discord_thread_id, discord_message_id, parts, published_at)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (self.guild_id, message_id, discord_thread_id, discord_message_id, parts, time.time()),
+        )
+        self.conn.commit()
+
+    def discord_thread_ids(self):
+        """Ids des threads Discord déjà associés à un thread"""
+        cursor = self.conn.execute(
+            "SELECT discord_thread_id FROM discord_threads WHERE guild_id = ?", (self.guild_id,)
+        )
+        return {discord_thread_id for discord_thread_id, in cursor}
+
+    def published_threads(self, channel_id):
+        """Threads Discord publiés dans un canal, par id de thread"""
+        cursor = self.conn.execute(
+            "SELECT thread_id, discord_thread_id FROM discord_threads WHERE guild_id = ? AND channel_id = ?",
+            (self.guild_id, channel_id),
+        )
+        return dict(cursor.fetchall())
+
+    def forget_thread(self, thread_id):
+        """Oublie un thread supprimé sur Discord, pour le publier à nouveau"""
+        discord_thread_id = self.discord_thread_id(thread_id)
+        self.conn.execute(
+            "DELETE FROM discord_messages WHERE guild_id = ? AND discord_thread_id = ?",
+            (self.guild_id, discord_thread_id),
+        )
+        self.conn.execute(
+            "DELETE FROM discord_threads WHERE guild_id = ? AND thread_id = ?",
+            (self.guild_id, thread_id),
+        )
+        self.conn.commit()
+
+    def forget_forum(self, forum_id):
+        """Oublie un forum dont le canal a été supprimé sur Discord, avec ses threads"""
+        channel_id = self.channel_id(forum_id)
+        self.conn.execute("""
+            DELETE FROM discord_messages WHERE guild_id = ? AND discord_thread_id IN (
+                SELECT discord_thread_id FROM discord_threads WHERE guild_id = ? AND channel_id = ?
+            )
+        """, (self.guild_id, self.guild_id, channel_id))
+        self.conn.execute(
+            "DELETE FROM discord_threads WHERE guild_id = ? AND channel_id = ?",
+            (self.guild_id, channel_id),
+        )
+        self.conn.execute(
+            "DELETE FROM discord_forums WHERE guild_id = ? AND forum_id = ?",
+            (self.guild_id, forum_id),
+        )
+        self.conn.commit()
+
+    def unpublished_threads(self, forum_id):
+        """Ids des threads d'un forum ayant des messages pas encore publiés"""
+        cursor = self.conn.execute("""
+            SELECT DISTINCT m.thread_id
+            FROM messages m JOIN threads t ON t.id = m.thread_id
+            WHERE t.forum_id = ? AND NOT EXISTS (
+                SELECT 1 FROM discord_messages d WHERE d.guild_id = ? AND d.message_id = m.id
+            )
+        """, (forum_id, self.guild_id))
+        return {thread_id for thread_id, in cursor}
+
+    def unpublished_count(self):
+        """Nombre de messages pas encore publiés"""
+        return self.conn.execute("""
+            SELECT COUNT(*) FROM messages m WHERE NOT EXISTS (
+                SELECT 1 FROM discord_messages d WHERE d.guild_id = ? AND d.message_id = m.id
+            )
+        """, (self.guild_id,)).fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
 class ForumPublisher:
     def __init__(self, db_path):
         self.db_path = db_path
         self.guild = None
         self.category = None
+        self.state = None
+        # Threads Discord de chaque canal, et ceux sans état de publication
+        # par nom, lus au cours de la publication
+        self.channel_threads = {}
+        self.unknown_threads = {}
         
     def get_connection(self):
         return sqlite3.connect(self.db_path)
@@ -35,6 +163,7 @@ class ForumPublisher:
     async def setup_guild(self, guild):
         """Configure le serveur Discord"""
         self.guild = guild
+        self.state = PublishState(self.db_path, guild.id)
         
         # Créer ou trouver la catégorie "Forum CAASV"
         category_name = "📁 Forum CAASV"
@@ -86,17 +215,32 @@ class ForumPublisher:
         conn.close()
         return threads
     
-    def get_messages_by_thread(self, thread_id):
-        """Récupère tous les messages d'un thread"""
+    def get_messages_by_thread(self, thread_id, unpublished_only=False):
+        """Récupère tous les messages d'un thread, ou seulement ceux pas encore publiés"""
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, author, content, post_date, post_number 
-            FROM messages 
-            WHERE thread_id = ? 
-            ORDER BY post_number
-        """, (thread_id,))
-        messages = cursor.fetchall()
+        if unpublished_only:
+            cursor.execute("""
+                SELECT id, author, content, post_date, post_number, content_dict_id
+                FROM messages m
+                WHERE thread_id = ? AND NOT EXISTS (
+                    SELECT 1 FROM discord_messages d WHERE d.guild_id = ? AND d.message_id = m.id
+                )
+                ORDER BY post_number
+            """, (thread_id, self.state.guild_id))
+        else:
+            cursor.execute("""
+                SELECT id, author, content, post_date, post_number, content_dict_id
+                FROM messages 
+                WHERE thread_id = ? 
+                ORDER BY post_number
+            """, (thread_id,))
+        # Décompresse le contenu des messages stockés compressés
+        decoder = MessageDecoder(conn)
+        messages = [
+            (msg_id, author, decoder.decode(content, dict_id), post_date, post_number)
+            for msg_id, author, content, post_date, post_number, dict_id in cursor.fetchall()
+        ]
         conn.close()
         return messages
     
@@ -145,19 +289,153 @@ class ForumPublisher:
             )
             return channel
     
-    async def create_thread_in_forum(self, forum_channel, thread_data, messages):
-        """Crée un thread dans un canal forum avec tous les messages"""
-        thread_id, title, author, replies, views, last_date, last_author, url = thread_data
+    async def get_forum_channel(self, forum_data):
+        """Canal Discord d'un forum, créé à sa première publication"""
+        forum_id = forum_data[0]
+        channel_id = self.state.channel_id(forum_id)
+        if channel_id:
+            channel = self.guild.get_channel(channel_id)
+            if channel:
+                return channel
+            logger.warning(f"Canal du forum {forum_data[2]} supprimé, nouvelle publication du forum")
+            self.state.forget_forum(forum_id)
         
-        if not messages:
-            logger.warning(f"Pas de messages pour le thread: {title}")
-            return
+        channel = await self.create_forum_channel(forum_data)
+        self.state.save_forum(forum_id, channel.id)
+        return channel
+    
+    async def get_discord_thread(self, thread_id):
+        """Thread Discord d'un thread déjà publié, None s'il ne l'est pas (ou plus)"""
+        discord_thread_id = self.state.discord_thread_id(thread_id)
+        if discord_thread_id is None:
+            return None
+        
+        # Les threads archivés ne sont pas dans le cache du bot
+        discord_thread = self.guild.get_thread(discord_thread_id)
+        if discord_thread is None:
+            try:
+                discord_thread = await self.guild.fetch_channel(discord_thread_id)
+            except discord.NotFound:
+                logger.warning(f"Thread Discord {discord_thread_id} supprimé, nouvelle publication du thread")
+                self.state.forget_thread(thread_id)
+                return None
+        return discord_thread
+    
+    async def get_channel_threads(self, forum_channel):
+        """Threads Discord d'un canal par id, archivés compris, lus une fois par publication
+
+        Retourne aussi si la liste est complète : elle ne l'est pas quand les
+        threads archivés n'ont pas pu être lus.
+        """
+        if forum_channel.id not in self.channel_threads:
+            threads = {t.id: t for t in getattr(forum_channel, 'threads', [])}
+            complete = True
+            try:
+                async for discord_thread in forum_channel.archived_threads(limit=None):
+                    threads[discord_thread.id] = discord_thread
+            except (AttributeError, discord.HTTPException) as e:
+                logger.warning(f"Threads archivés du canal {forum_channel.name} illisibles: {e}")
+                complete = False
+            self.channel_threads[forum_channel.id] = threads, complete
+        return self.channel_threads[forum_channel.id]
+    
+    async def forget_deleted_threads(self, forum_channel):
+        """Oublie les threads publiés d'un canal supprimés depuis sur Discord
+
+        Leurs messages sont alors à publier à nouveau, même sans nouveau
+        message dans le thread du forum.
+        """
+        threads, complete = await self.get_channel_threads(forum_channel)
+        if not complete:
+            return  # Un thread archivé non lu n'est pas pour autant supprimé
+        for thread_id, discord_thread_id in self.state.published_threads(forum_channel.id).items():
+            if discord_thread_id not in threads:
+                logger.warning(f"Thread Discord {discord_thread_id} supprimé, nouvelle publication du thread")
+                self.state.forget_thread(thread_id)
+    
+    async def get_unknown_threads(self, forum_channel):
+        """Threads Discord d'un canal qui ne sont associés à aucun thread, par nom
+
+        Ce sont ceux publiés par l'ancienne version du publisher, qui
+        n'enregistrait pas ses publications (elle archivait chaque thread
+        publié, d'où la lecture des threads archivés).
+        """
+        if forum_channel.id not in self.unknown_threads:
+            threads, complete = await self.get_channel_threads(forum_channel)
+            known = self.state.discord_thread_ids()
+            unknown = {}
+            for discord_thread in threads.values():
+                if discord_thread.id not in known:
+                    unknown.setdefault(discord_thread.name, []).append(discord_thread)
+            self.unknown_threads[forum_channel.id] = unknown
+        return self.unknown_threads[forum_channel.id]
+    
+    async def adopt_thread(self, forum_channel, thread_data, messages):
+        """Reprend un thread déjà publié par l'ancienne version du publisher
+
+        Le thread Discord est retrouvé par son nom. L'ancien publisher publiait
+        tous les messages dans l'ordre : sont déjà publiés le premier message et
+        ceux jusqu'au dernier dont l'en-tête est dans le thread. Retourne le
+        thread Discord (None s'il n'y en a pas) et les messages restant à publier.
+        """
+        thread_id, title = thread_data[0], thread_data[1]
+        clean_title = title[:100] if title else f"Thread {thread_id}"
+        candidates = (await self.get_unknown_threads(forum_channel)).get(clean_title)
+        if not candidates:
+            return None, messages
+        discord_thread = candidates.pop(0)
+        
+        # Premier message Discord de chaque en-tête de message
+        sent_ids = {}
+        async for sent in discord_thread.history(limit=None, oldest_first=True):
+            sent_ids.setdefault(sent.content.split("\n", 1)[0], sent.id)
+        published = 1
+        for index, msg in enumerate(messages[1:], 2):
+            if self.message_header(msg).rstrip("\n") in sent_ids:
+                published = index
+        
+        self.state.save_thread(thread_id, forum_channel.id, discord_thread.id)
+        for msg in messages[:published]:
+            sent_id = sent_ids.get(self.message_header(msg).rstrip("\n"))
+            self.state.save_message(msg[0], discord_thread.id, sent_id, 1 if sent_id else 0)
+        logger.info(f"Thread déjà publié repris: {clean_title} ({published} messages déjà publiés)")
+        return discord_thread, messages[published:]
+    
+    def split_content(self, content, max_length):
+        """Divise un contenu en morceaux de max_length caractères au plus"""
+        chunks = []
+        remaining_content = content
+        while remaining_content:
+            if len(remaining_content) <= max_length:
+                chunks.append(remaining_content)
+                break
+            
+            # Trouver un bon endroit pour couper (éviter de couper au milieu d'un mot)
+            cut_index = max_length
+            while cut_index > max_length - 100 and cut_index > 0:
+                if remaining_content[cut_index] in [' ', '\n', '.', '!', '?']:
+                    break
+                cut_index -= 1
+            
+            if cut_index <= max_length - 100:
+                cut_index = max_length
+            
+            chunks.append(remaining_content[:cut_index])
+            remaining_content = remaining_content[cut_index:].lstrip()
+        return chunks
+    
+    async def create_thread_in_forum(self, forum_channel, thread_data, first_message):
+        """Crée un thread dans un canal forum avec le premier message
+
+        Retourne le thread Discord, le message qui l'ouvre et les suites du
+        premier message, qui restent à poster.
+        """
+        thread_id, title, author, replies, views, last_date, last_author, url = thread_data
         
         # Nettoyer le titre pour Discord
         clean_title = title[:100] if title else f"Thread {thread_id}"
         
         # Premier message (contenu du thread)
-        first_message = messages[0]
         first_content = first_message[2] if first_message[2] else "Contenu vide"
         
         # Créer le header avec métadonnées
@@ -166,121 +444,132 @@ class ForumPublisher:
         
         # Calculer l'espace restant pour le contenu (2000 - header - marge de sécurité)
         max_content_length = 2000 - len(header) - 50
-        
-        # Diviser le contenu en chunks si nécessaire
-        content_chunks = []
-        if len(first_content) <= max_content_length:
-            content_chunks.append(first_content)
-        else:
-            # Diviser le contenu en morceaux de taille appropriée
-            remaining_content = first_content
-            while remaining_content:
-                if len(remaining_content) <= max_content_length:
-                    content_chunks.append(remaining_content)
-                    break
-                else:
-                    # Trouver un bon endroit pour couper (éviter de couper au milieu d'un mot)
-                    cut_index = max_content_length
-                    while cut_index > max_content_length - 100 and cut_index > 0:
-                        if remaining_content[cut_index] in [' ', '\n', '.', '!', '?']:
-                            break
-                        cut_index -= 1
-                    
-                    if cut_index <= max_content_length - 100:
-                        cut_index = max_content_length
-                    
-                    content_chunks.append(remaining_content[:cut_index])
-                    remaining_content = remaining_content[cut_index:].lstrip()
+        content_chunks = self.split_content(first_content, max_content_length)
         
         # Premier chunk avec header
         first_chunk = header + content_chunks[0]
         
-        try:
-            if hasattr(forum_channel, 'create_thread'):
-                # Canal forum moderne
-                thread, message = await forum_channel.create_thread(
-                    name=clean_title,
-                    content=first_chunk
-                )
-                discord_thread = thread
+        if hasattr(forum_channel, 'create_thread'):
+            # Canal forum moderne
+            thread, message = await forum_channel.create_thread(
+                name=clean_title,
+                content=first_chunk
+            )
+            discord_thread = thread
+        else:
+            # Canal texte classique
+            message = await forum_channel.send(
+                f"# {clean_title}\n\n{first_chunk}"
+            )
+            
+            # Créer un thread à partir du message
+            discord_thread = await message.create_thread(name=clean_title)
+        
+        logger.info(f"Thread créé: {clean_title}")
+        return discord_thread, message, content_chunks[1:]
+    
+    def message_header(self, msg):
+        """En-tête d'un message posté dans un thread"""
+        msg_id, author, content, post_date, post_number = msg
+        return f"**{author or 'Inconnu'}** ({post_date or 'Date inconnue'}):\n"
+    
+    async def post_message(self, discord_thread, msg):
+        """Poste un message dans un thread Discord, en plusieurs parties si nécessaire
+
+        Retourne le premier message Discord posté (None pour un message vide,
+        qui n'est pas posté) et le nombre de parties.
+        """
+        msg_id, author, content, post_date, post_number = msg
+        
+        if not content or content.strip() == "":
+            return None, 0
+        
+        # Créer le header pour ce message
+        msg_header = self.message_header(msg)
+        max_msg_length = 2000 - len(msg_header) - 10
+        
+        # Diviser le message en plusieurs messages si nécessaire
+        chunks = self.split_content(content, max_msg_length)
+        first_sent = None
+        for part_num, chunk in enumerate(chunks, 1):
+            if part_num == 1:
+                formatted_message = msg_header + chunk
             else:
-                # Canal texte classique
-                message = await forum_channel.send(
-                    f"# {clean_title}\n\n{first_chunk}"
+                formatted_message = f"*(suite {part_num})*\n{chunk}"
+            sent = await discord_thread.send(formatted_message)
+            first_sent = first_sent or sent
+        return first_sent, len(chunks)
+    
+    async def publish_thread(self, forum_channel, thread_data):
+        """Publie les messages pas encore publiés d'un thread
+
+        Le thread Discord est créé à la première publication ; ensuite les
+        nouveaux messages sont ajoutés au thread existant.
+        """
+        thread_id, title = thread_data[0], thread_data[1]
+        clean_title = title[:100] if title else f"Thread {thread_id}"
+        
+        try:
+            discord_thread = await self.get_discord_thread(thread_id)
+            # Lus une fois le thread Discord retrouvé : un thread supprimé sur
+            # Discord est oublié, et tous ses messages sont alors à republier
+            messages = self.get_messages_by_thread(thread_id, unpublished_only=True)
+            if not messages:
+                return
+            if discord_thread is None:
+                # Sans état, le thread a pu être publié par l'ancien publisher
+                discord_thread, messages = await self.adopt_thread(forum_channel, thread_data, messages)
+                if discord_thread is not None and not messages:
+                    return
+            if discord_thread is None:
+                discord_thread, message, suites = await self.create_thread_in_forum(
+                    forum_channel, thread_data, messages[0]
                 )
+                # Enregistré avant les suites : une reprise ne recrée pas le thread
+                self.state.save_thread(thread_id, forum_channel.id, discord_thread.id)
                 
-                # Créer un thread à partir du message
-                discord_thread = await message.create_thread(name=clean_title)
-            
-            logger.info(f"Thread créé: {clean_title}")
-            
-            # Poster les chunks supplémentaires du premier message s'il y en a
-            for i, chunk in enumerate(content_chunks[1:], 1):
-                await discord_thread.send(f"*(suite {i})*\n{chunk}")
-                await asyncio.sleep(0.5)  # Petite pause entre les chunks
+                # Poster les chunks supplémentaires du premier message s'il y en a
+                for i, chunk in enumerate(suites, 1):
+                    await discord_thread.send(f"*(suite {i})*\n{chunk}")
+                    await asyncio.sleep(0.5)  # Petite pause entre les chunks
+                # Le premier message n'est publié qu'avec toutes ses suites :
+                # une reprise le publie à nouveau en entier
+                self.state.save_message(messages[0][0], discord_thread.id, message.id, len(suites) + 1)
+                messages = messages[1:]
+            else:
+                # Rouvrir le thread archivé et verrouillé à la publication précédente
+                if discord_thread.archived or discord_thread.locked:
+                    await discord_thread.edit(archived=False, locked=False)
+                logger.info(f"Ajout de {len(messages)} messages au thread: {clean_title}")
             
             # Poster les messages suivants
-            for msg in messages[1:]:
-                msg_id, author, content, post_date, post_number = msg
-                
-                if not content or content.strip() == "":
-                    continue
-                
-                # Créer le header pour ce message
-                msg_header = f"**{author or 'Inconnu'}** ({post_date or 'Date inconnue'}):\n"
-                max_msg_length = 2000 - len(msg_header) - 10
-                
-                # Diviser le message en chunks si nécessaire
-                if len(content) <= max_msg_length:
-                    formatted_message = msg_header + content
-                    await discord_thread.send(formatted_message)
-                else:
-                    # Diviser en plusieurs messages
-                    remaining_content = content
-                    part_num = 1
-                    
-                    while remaining_content:
-                        if len(remaining_content) <= max_msg_length:
-                            if part_num == 1:
-                                formatted_message = msg_header + remaining_content
-                            else:
-                                formatted_message = f"*(suite {part_num})*\n{remaining_content}"
-                            await discord_thread.send(formatted_message)
-                            break
-                        else:
-                            # Trouver un bon endroit pour couper
-                            cut_index = max_msg_length
-                            while cut_index > max_msg_length - 100 and cut_index > 0:
-                                if remaining_content[cut_index] in [' ', '\n', '.', '!', '?']:
-                                    break
-                                cut_index -= 1
-                            
-                            if cut_index <= max_msg_length - 100:
-                                cut_index = max_msg_length
-                            
-                            chunk_content = remaining_content[:cut_index]
-                            if part_num == 1:
-                                formatted_message = msg_header + chunk_content
-                            else:
-                                formatted_message = f"*(suite {part_num})*\n{chunk_content}"
-                            
-                            await discord_thread.send(formatted_message)
-                            remaining_content = remaining_content[cut_index:].lstrip()
-                            part_num += 1
-                
-                await asyncio.sleep(1)  # Éviter le rate limiting
+            for msg in messages:
+                sent, parts = await self.post_message(discord_thread, msg)
+                self.state.save_message(msg[0], discord_thread.id, sent.id if sent else None, parts)
+                if sent:
+                    await asyncio.sleep(1)  # Éviter le rate limiting
             
             logger.info(f"Thread terminé: {clean_title} ({len(messages)} messages)")
             
+            # Fermer et archiver le thread
+            try:
+                await discord_thread.edit(archived=True, locked=True)
+                logger.info(f"    Thread archivé: {clean_title[:50]}")
+            except Exception as e:
+                logger.error(f"    Erreur archivage thread {clean_title[:50]}: {e}")
+            
         except Exception as e:
-            logger.error(f"Erreur création thread {clean_title}: {e}")
+            logger.error(f"Erreur publication thread {clean_title}: {e}")
     
     async def publish_all_forums(self):
-        """Publie tous les forums sur Discord"""
+        """Publie sur Discord ce qui n'y est pas encore publié"""
         if not self.guild:
             logger.error("Guild non configurée")
             return
         
+        # Les threads des canaux ont pu changer depuis la publication précédente
+        self.channel_threads = {}
+        self.unknown_threads = {}
         forums = self.get_forums()
         logger.info(f"Publication de {len(forums)} forums...")
         
@@ -288,37 +577,26 @@ class ForumPublisher:
             forum_id = forum_data[0]
             forum_title = forum_data[2]
             
-            logger.info(f"Traitement du forum: {forum_title}")
+            # Trouver ou créer le canal pour ce forum
+            forum_channel = await self.get_forum_channel(forum_data)
+            await self.forget_deleted_threads(forum_channel)
             
-            # Créer le canal pour ce forum
-            forum_channel = await self.create_forum_channel(forum_data)
+            # Seuls les threads ayant de nouveaux messages sont publiés
+            unpublished = self.state.unpublished_threads(forum_id)
+            if not unpublished:
+                logger.info(f"Forum à jour: {forum_title}")
+                continue
             
-            # Récupérer tous les threads de ce forum
-            threads = self.get_threads_by_forum(forum_id)
-            logger.info(f"  {len(threads)} threads trouvés")
+            logger.info(f"Traitement du forum: {forum_title}")
+            threads = [t for t in self.get_threads_by_forum(forum_id) if t[0] in unpublished]
+            logger.info(f"  {len(threads)} threads à publier")
 
             for thread_data in reversed(threads):
-                thread_id = thread_data[0]
                 thread_title = thread_data[1]
                 
                 logger.info(f"    Traitement du thread: {thread_title[:50]}...")
                 
-                # Récupérer tous les messages de ce thread
-                messages = self.get_messages_by_thread(thread_id)
-                
-                if messages:
-                    await self.create_thread_in_forum(forum_channel, thread_data, messages)
-
-                # Close and archive the thread if possible
-                if hasattr(forum_channel, 'threads'):
-                    for thread in forum_channel.threads:
-                        if thread.name == thread_title[:100]:
-                            try:
-                                await thread.edit(archived=True, locked=True)
-                                logger.info(f"    Thread archivé: {thread_title[:50]}")
-                            except Exception as e:
-                                logger.error(f"    Erreur archivage thread {thread_title[:50]}: {e}")
-                            break
+                await self.publish_thread(forum_channel, thread_data)
                 
                 # Pause entre chaque thread
                 await asyncio.sleep(2)
@@ -348,6 +626,7 @@ async def on_ready():
         # Demander confirmation
         print(f"\n🚀 Prêt à publier le forum sur le serveur: {guild.name}")
         print(f"📁 Catégorie: {publisher.category.name}")
+        print(f"📝 Messages à publier: {publisher.state.unpublished_count()}")
         print("\n⚠️  ATTENTION: Cette opération va créer de nombreux canaux et messages!")
         print("   Assurez-vous que le bot a les permissions nécessaires.")
         
@@ -359,6 +638,7 @@ async def on_ready():
             print("\n✅ Publication terminée!")
         else:
             print("\n❌ Publication annulée.")
+        publisher.state.close()
         
         # Arrêter le bot
         await bot.close()
@@ -379,6 +659,11 @@ if __name__ == "__main__":
         print("   - Créer des threads publics")
         print("   - Gérer les messages")
     else:
+        conn = sqlite3.connect(DB_NAME)
+        has_state = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'discord_messages'").fetchone()
+        conn.close()
+        if not has_state:
+            raise SystemExit(f"❌ {DB_NAME} n'a pas d'état de publication, lancez le scraper une fois pour la mettre à jour")
         try:
             bot.run(BOT_TOKEN)
         except Exception as e:
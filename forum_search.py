@@ -0,0 +1,130 @@
+"""Full-text search over the scraped messages.
+
+messages_fts indexes the content, author and thread title of every message.
+The scraper keeps it up to date as it saves messages. Search the archive with:
+
+    python forum_search.py "assemblée générale"
+    python forum_search.py --raw 'sortie NEAR(club, 5)' --limit 50
+
+Words are searched as given, accents and case ignored; --raw passes an FTS5
+query (AND, OR, NOT, "phrases", prefix*, title:word...) through as is.
+Rebuild the index, e.g. for contents compressed before it existed, with:
+
+    python forum_search.py --rebuild
+"""
+import argparse
+import sqlite3
+import time
+
+from message_codec import MessageDecoder
+
+DB_NAME = "forum_data.db"
+
+# bm25 weights of the indexed columns: content, title, author
+COLUMN_WEIGHTS = (1.0, 3.0, 1.0)
+
+
+def fts_query(text):
+    """FTS5 query matching all the words of text"""
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in text.split())
+
+
+def search(conn, query, limit=20, raw=False):
+    """Best ranked messages matching query, joined to their thread and forum"""
+    decoder = MessageDecoder(conn)
+    rows = conn.execute(f'''
+        SELECT m.id, f.title, t.title, t.url, m.author, m.post_date, m.post_number,
+               m.content, m.content_dict_id, hits.score
+        FROM (
+            SELECT rowid, bm25(messages_fts, {", ".join(map(str, COLUMN_WEIGHTS))}) AS score
+            FROM messages_fts
+            WHERE messages_fts MATCH ?
+            ORDER BY score
+            LIMIT ?
+        ) hits
+        JOIN messages m ON m.id = hits.rowid
+        JOIN threads t ON t.id = m.thread_id
+        JOIN forums f ON f.id = t.forum_id
+        ORDER BY hits.score
+    ''', (query if raw else fts_query(query), limit))
+    return [
+        {
+            "message_id": message_id,
+            "forum": forum,
+            "thread": thread,
+            "thread_url": thread_url,
+            "author": author,
+            "post_date": post_date,
+            "post_number": post_number,
+            "content": decoder.decode(content, dict_id),
+            "score": score,
+        }
+        for (message_id, forum, thread, thread_url, author, post_date, post_number,
+             content, dict_id, score) in rows
+    ]
+
+
+def rebuild_index(conn, batch_size=1000):
+    """Index every stored message again, returning how many were indexed"""
+    decoder = MessageDecoder(conn)
+    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('delete-all')")
+    indexed = 0
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT m.id, m.content, m.content_dict_id, t.title, m.author
+            FROM messages m JOIN threads t ON t.id = m.thread_id
+            WHERE m.id > ?
+            ORDER BY m.id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        conn.executemany(
+            "INSERT INTO messages_fts (rowid, content, title, author) VALUES (?, ?, ?, ?)",
+            [(message_id, decoder.decode(content, dict_id), title, author)
+             for message_id, content, dict_id, title, author in rows],
+        )
+        indexed += len(rows)
+        last_id = rows[-1][0]
+    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+    conn.commit()
+    return indexed
+
+
+def snippet(content, words, width=200):
+    """Part of content around the first searched word found"""
+    lower = content.lower()
+    positions = [lower.find(word.lower()) for word in words]
+    start = min([p for p in positions if p >= 0], default=0)
+    start = max(start - width // 4, 0)
+    return ("..." if start else "") + content[start:start + width].replace("\n", " ")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("query", nargs="?")
+    parser.add_argument("--db", default=DB_NAME)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--raw", action="store_true", help="pass the query to FTS5 as is")
+    parser.add_argument("--rebuild", action="store_true", help="index every message again")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone():
+        raise SystemExit(f"{args.db} has no search index, run the scraper on it once to upgrade it")
+
+    if args.rebuild:
+        start = time.perf_counter()
+        print(f"Indexed {rebuild_index(conn)} messages in {time.perf_counter() - start:.1f}s")
+    elif args.query:
+        start = time.perf_counter()
+        hits = search(conn, args.query, args.limit, args.raw)
+        elapsed = time.perf_counter() - start
+        for hit in hits:
+            print(f"\n{hit['forum']} > {hit['thread']} #{hit['post_number']}"
+                  f" - {hit['author']}, {hit['post_date']}")
+            print(f"  {hit['thread_url']}")
+            print(f"  {snippet(hit['content'], args.query.split())}")
+        print(f"\n{len(hits)} results in {elapsed * 1000:.1f} ms")
+    else:
+        parser.print_help()
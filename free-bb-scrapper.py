@@ -1,12 +1,33 @@
+import asyncio
+import contextvars
+import cProfile
+import functools
+import gzip
+import hashlib
+import json
+import multiprocessing
 import re
+import socket
 import requests
 import sqlite3
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import aclosing, contextmanager
 from datetime import datetime
+from itertools import chain, islice
 
-from urllib.parse import urljoin
+from email.utils import parsedate_to_datetime
+from http.cookiejar import LWPCookieJar
+from urllib.parse import urljoin, urlparse, urlunparse
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+
+import message_codec
+from forum_dates import parse_forum_date, shows_year
 
 # To be filled
 BASE_URL = ""
@@ -16,14 +37,603 @@ PASSWORD = ""
 LOGIN_PAGE = f"{BASE_URL}/login"
 LOGIN_POST = f"{BASE_URL}/login_check"
 
+# Session cache: the cookies of a logged-in session are saved to SESSION_FILE,
+# a text cookie jar keeping their expiry, and reused by the next runs, which
+# only log in while they have no unexpired cookies. A page answered with the login form means the session expired
+# mid-crawl: the scraper logs in again and fetches the page again.
+SESSION_FILE = "session.txt"
 
-DB_NAME = "forum_data.db"
 
-session = requests.Session()
+DB_NAME = "forum_data.db"
 
-def init_database():
+# Multi-site mode: with SITES set, one process mirrors several free-bb forums
+# concurrently, each with its own session, login, throttle and frontier.
+# Entries give base_url, username and password (BASE_URL, USERNAME and
+# PASSWORD above are then ignored) and optionally db_name: sites without one
+# share DB_NAME, where rows are tagged with their site's host.
+SITES = []
+# SITES = [
+#     {"base_url": "http://foo.free-bb.com", "username": "...", "password": "..."},
+#     {"base_url": "http://bar.free-bb.com", "username": "...", "password": "...", "db_name": "bar.db"},
+# ]
+
+# Number of pages of a forum or thread fetched in parallel (1 = one at a time)
+PAGE_WORKERS = 4
+
+# Asynchronous crawl engine: forums, thread lists and threads are crawled as a
+# pipeline, with at most CRAWL_CONCURRENCY requests in flight overall
+ASYNC_CRAWL = False
+CRAWL_CONCURRENCY = 16
+QUEUE_SIZE = 100
+
+# Database writes are committed every COMMIT_ROWS rows or COMMIT_INTERVAL
+# seconds, whichever comes first
+COMMIT_ROWS = 1000
+COMMIT_INTERVAL = 5.0
+
+# Incremental crawl: threads already in the database are only re-scraped when
+# the thread list shows new posts, starting from the page of the last stored
+# post. POSTS_PER_PAGE must match the forum's pagination.
+INCREMENTAL = False
+POSTS_PER_PAGE = 15
+
+# Page prediction: the number of pages of a thread is predicted from its reply
+# count in the thread list, so all its pages are requested at once instead of
+# waiting for page 1's pagination. Page 1 still checks the prediction: missing
+# pages are fetched afterwards and pages past the last one are dropped.
+PREDICT_PAGES = True
+
+# Priority crawl: every thread list is read first, then threads are crawled
+# hottest first, ranked by their last post date, replies and views. No new
+# thread is started once CRAWL_REQUEST_BUDGET HTTP requests or
+# CRAWL_TIME_BUDGET seconds are used up (None for no limit), leaving the
+# least active threads for the next run.
+PRIORITY_CRAWL = False
+CRAWL_REQUEST_BUDGET = None
+CRAWL_TIME_BUDGET = None
+# A thread's priority is its activity, replies plus views / VIEWS_PER_REPLY,
+# divided by (hours since its last post + 2) ** PRIORITY_GRAVITY
+VIEWS_PER_REPLY = 20
+PRIORITY_GRAVITY = 1.5
+
+# Resumable crawl: forum thread lists and threads to scrape are queued in the
+# database, so an interrupted crawl picks up where it stopped. Items failing
+# FRONTIER_MAX_ATTEMPTS times are left aside.
+RESUMABLE_CRAWL = False
+FRONTIER_MAX_ATTEMPTS = 3
+
+# Distributed crawl: WORKERS processes, plus any started on other machines
+# with DISTRIBUTED on and the same database file, share the frontier. Each
+# claims items with a lease of LEASE_SECONDS, renewed as the item progresses;
+# items of a dead worker are claimed again once their lease has expired.
+# Across machines, WAL can't be used (it needs shared memory): set
+# DB_JOURNAL_MODE to "DELETE" and use a filesystem with working locks.
+DISTRIBUTED = False
+WORKERS = 4
+LEASE_SECONDS = 300
+WORKER_POLL_INTERVAL = 5
+
+# HTML parser used by BeautifulSoup: "html.parser" (pure Python) or "lxml"
+# (much faster, needs the lxml package). With PARTIAL_PARSING, only the page
+# regions that are scraped are built into a tree (see PAGE_REGIONS).
+PARSER_BACKEND = "html.parser"
+PARTIAL_PARSING = False
+
+# Raw HTML cache: fetched pages are kept gzipped in PAGE_CACHE_DIR and
+# revalidated with conditional GETs (ETag / Last-Modified). With REPLAY_MODE,
+# pages are only read from the cache, without any network access, to rebuild
+# the database after a scraper fix. The database is rebuilt from scratch:
+# stored messages are never overwritten, so DB_NAME (or the db_name of each
+# site) must not exist yet. Move the old one away first.
+PAGE_CACHE = False
+PAGE_CACHE_DIR = "page_cache"
+REPLAY_MODE = False
+
+# Parse pool: with PARSE_PROCESSES > 0, thread list and thread pages are
+# downloaded by the I/O threads and parsed in that many worker processes, so
+# parsing is spread over several cores instead of holding up the fetches
+PARSE_PROCESSES = 0
+
+# Compressed content: message contents are stored compressed with a dictionary
+# trained on the first DICT_SAMPLE_MESSAGES messages saved plain (zstd if the
+# zstandard package is installed, zlib otherwise). Existing databases can be
+# converted with: python message_codec.py compress forum_data.db
+COMPRESS_CONTENT = False
+DICT_SAMPLE_MESSAGES = message_codec.DICT_SAMPLE_MESSAGES
+
+# Crawl metrics (request counts and latencies, bytes, parse and database
+# times, errors) are written every METRICS_INTERVAL seconds to METRICS_FILE,
+# as JSON or, for a .prom file, in Prometheus text format. A summary is
+# printed at the end of the run.
+METRICS_FILE = "crawl_metrics.json"
+METRICS_INTERVAL = 30
+
+# Set PROFILE_URL to a forum or thread URL to cProfile its crawl into
+# PROFILE_FILE (blocking and resumable crawls). Its pages are then fetched
+# one at a time so all the work shows up in the profile.
+PROFILE_URL = None
+PROFILE_FILE = "crawl_profile.pstats"
+
+# Adaptive throttling per host (AIMD): the number of requests in flight to a
+# host grows by one for each window of healthy responses and is halved on a
+# 429, a 5xx or a latency spike (THROTTLE_LATENCY_SPIKE times the usual
+# latency). Retry-After is honored. Failed requests are retried FETCH_RETRIES
+# times with exponential backoff, then pages are re-queued PAGE_REQUEUES times.
+THROTTLE_START_CONCURRENCY = 4
+THROTTLE_MAX_CONCURRENCY = 16
+THROTTLE_LATENCY_SPIKE = 4.0
+REQUEST_TIMEOUT = 30
+FETCH_RETRIES = 3
+RETRY_BACKOFF = 1.0
+PAGE_REQUEUES = 2
+
+# Keep enough pooled connections for the parallel page fetches
+POOL_SIZE = max(PAGE_WORKERS, CRAWL_CONCURRENCY)
+
+def mount_adapters(http_session):
+    http_session.mount("http://", HTTPAdapter(pool_maxsize=POOL_SIZE))
+    http_session.mount("https://", HTTPAdapter(pool_maxsize=POOL_SIZE))
+
+class Site:
+    """A free-bb forum to crawl, with its own HTTP session and login state"""
+
+    def __init__(self, base_url, username="", password="", db_name=DB_NAME, session_file=None,
+                 login_page=None, login_post=None):
+        self.base_url = base_url.rstrip("/")
+        # Sites are told apart by host, in the database too
+        self.name = urlparse(self.base_url).netloc.lower()
+        self.username = username
+        self.password = password
+        self.db_name = db_name
+        self.session_file = session_file or f"session-{self.name.replace(':', '_')}.txt"
+        self.login_page = login_page or f"{self.base_url}/login"
+        self.login_post = login_post or f"{self.base_url}/login_check"
+        self.session = requests.Session()
+        mount_adapters(self.session)
+        self.login_lock = threading.Lock()
+        self.login_generation = 0  # number of times the session was renewed during this run
+        # HTTP requests answered by this site, for its crawl budget
+        self.requests = 0
+        self.requests_lock = threading.Lock()
+
+    def count_request(self):
+        with self.requests_lock:
+            self.requests += 1
+
+# The site crawled by the current thread (or task); worker threads of a site
+# are started with a copy of its context
+default_site = Site(BASE_URL, USERNAME, PASSWORD, DB_NAME, SESSION_FILE, LOGIN_PAGE, LOGIN_POST)
+current_site = contextvars.ContextVar("current_site", default=default_site)
+session = default_site.session
+
+def submit_in_context(executor, fn, *args):
+    """Submit fn to a thread pool, running in a copy of the caller's context (its site)"""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+class CrawlMetrics:
+    """Thread-safe counters and latency histograms of the crawl"""
+
+    # Upper bounds of the latency histogram buckets, in seconds
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Start over with no metrics (e.g. in a forked worker)"""
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self.dumper = None
+        self.stopped = threading.Event()
+        # Names of the timers running in each thread
+        self.running = threading.local()
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def value(self, name):
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = {
+                    "buckets": [0] * (len(self.BUCKETS) + 1), "count": 0, "sum": 0.0,
+                }
+            index = next((i for i, bound in enumerate(self.BUCKETS) if seconds <= bound), len(self.BUCKETS))
+            histogram["buckets"][index] += 1
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+
+    @contextmanager
+    def timer(self, name):
+        """Time a block, unless it runs within a timer of the same name (e.g. a
+        commit made by a timed write), which already counts it"""
+        running = self.running.__dict__.setdefault("names", set())
+        if name in running:
+            yield
+            return
+        running.add(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            running.discard(name)
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """Decorator recording the duration of each call of a function"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def percentile(self, histogram, fraction):
+        """Upper bound of the bucket holding the given fraction of observations"""
+        target = histogram["count"] * fraction
+        seen = 0
+        for bound, count in zip(self.BUCKETS + (float("inf"),), histogram["buckets"]):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "elapsed": time.time() - self.started_at,
+                "counters": dict(self.counters),
+                "histograms": {
+                    name: {"count": h["count"], "sum": h["sum"], "buckets": list(h["buckets"])}
+                    for name, h in self.histograms.items()
+                },
+            }
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"# TYPE freebb_{name} counter")
+            lines.append(f"freebb_{name} {value}")
+        for name, histogram in sorted(snapshot["histograms"].items()):
+            lines.append(f"# TYPE freebb_{name} histogram")
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS + ("+Inf",), histogram["buckets"]):
+                cumulative += count
+                lines.append(f'freebb_{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f"freebb_{name}_sum {histogram['sum']}")
+            lines.append(f"freebb_{name}_count {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path=METRICS_FILE):
+        """Write the current metrics, replacing the previous dump"""
+        if path.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.snapshot(), indent=2)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def start_dumper(self, path=METRICS_FILE, interval=METRICS_INTERVAL):
+        def run():
+            while not self.stopped.wait(interval):
+                self.dump(path)
+
+        self.dumper = threading.Thread(target=run, daemon=True)
+        self.dumper.start()
+
+    def stop(self, path=METRICS_FILE):
+        """Stop the periodic dumps and write the final one"""
+        self.stopped.set()
+        if self.dumper:
+            self.dumper.join()
+        self.dump(path)
+
+    def print_summary(self):
+        snapshot = self.snapshot()
+        elapsed = snapshot["elapsed"]
+        print(f"\nCrawl metrics ({elapsed:.0f}s):")
+        for name, value in sorted(snapshot["counters"].items()):
+            print(f"  {name}: {value} ({value / elapsed:.1f}/s)")
+        for name, histogram in sorted(snapshot["histograms"].items()):
+            if not histogram["count"]:
+                continue
+            print(f"  {name}: {histogram['count']} in {histogram['sum']:.1f}s,"
+                  f" avg {histogram['sum'] / histogram['count'] * 1000:.1f}ms,"
+                  f" p50 <= {self.percentile(histogram, 0.5)}s, p95 <= {self.percentile(histogram, 0.95)}s")
+
+metrics = CrawlMetrics()
+
+class HostThrottle:
+    """AIMD limit on the number of requests in flight to one host"""
+
+    def __init__(self, host):
+        self.host = host
+        self.cond = threading.Condition()
+        self.limit = float(THROTTLE_START_CONCURRENCY)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.latency = None         # moving average of successful responses
+        self.last_decrease = 0.0
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                self.cond.wait(wait if wait > 0 else None)
+
+    def release(self, latency, status=None, retry_after=None):
+        """Record the outcome of a request; status is None for connection errors"""
+        with self.cond:
+            self.in_flight -= 1
+            if status is None or status == 429 or status >= 500:
+                self.decrease(retry_after)
+            else:
+                spike = self.latency is not None and latency > THROTTLE_LATENCY_SPIKE * self.latency
+                # The average follows the host, so a lasting slowdown stops counting as spikes
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+                if spike:
+                    self.decrease(retry_after)
+                else:
+                    # Additive increase: +1 once a full window of requests went well
+                    self.limit = min(THROTTLE_MAX_CONCURRENCY, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+    def decrease(self, retry_after):
+        now = time.monotonic()
+        if retry_after:
+            self.paused_until = max(self.paused_until, now + retry_after)
+        # Requests already in flight fail together, only halve once for them
+        if now - self.last_decrease >= (self.latency or 1.0):
+            self.limit = max(1.0, self.limit / 2)
+            self.last_decrease = now
+            metrics.count("throttle_decreases")
+            print(f"Slowing down on {self.host}: {int(self.limit)} requests in flight max")
+
+host_throttles = {}
+host_throttles_lock = threading.Lock()
+
+def host_throttle(url):
+    host = urlparse(url).netloc
+    with host_throttles_lock:
+        if host not in host_throttles:
+            host_throttles[host] = HostThrottle(host)
+        return host_throttles[host]
+
+def retry_after_seconds(response):
+    """Delay asked by a Retry-After header, in seconds or as an HTTP date"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def is_retryable(error):
+    """Whether a failed fetch may succeed later (connection errors, 429, 5xx)"""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, requests.RequestException)
+
+def throttled_get(url, headers=None):
+    """GET through the host's throttle, retrying connection errors, 429 and 5xx with backoff"""
+    site = current_site.get()
+    throttle = host_throttle(url)
+    for attempt in range(FETCH_RETRIES + 1):
+        throttle.acquire()
+        start = time.perf_counter()
+        try:
+            r = site.session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException:
+            latency = time.perf_counter() - start
+            throttle.release(latency)
+            metrics.observe("http_fetch_seconds", latency)
+            metrics.count("http_errors")
+            if attempt == FETCH_RETRIES:
+                raise
+            retry_after = None
+        else:
+            latency = time.perf_counter() - start
+            retry_after = retry_after_seconds(r) if r.status_code in (429, 503) else None
+            throttle.release(latency, r.status_code, retry_after)
+            metrics.observe("http_fetch_seconds", latency)
+            metrics.count("http_requests")
+            site.count_request()
+            metrics.count("http_bytes_received", len(r.content))
+            if r.status_code != 429 and r.status_code < 500 or attempt == FETCH_RETRIES:
+                return r
+            metrics.count("http_errors")
+
+        metrics.count("http_retries")
+        # The throttle already holds back the whole host for a Retry-After
+        if not retry_after:
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+profiling = False
+
+@contextmanager
+def profiled(url):
+    """Run the crawl of a forum or thread under cProfile if it is PROFILE_URL"""
+    global profiling
+    if url != PROFILE_URL:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiling = True
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiling = False
+        profiler.dump_stats(PROFILE_FILE)
+        print(f"Profile of {url} saved to {PROFILE_FILE}")
+
+# Pragmas set on every connection. With WAL journaling, NORMAL synchronous
+# only syncs at checkpoints and readers don't block the writer.
+DB_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -64000,       # 64 MB
+    "mmap_size": 268435456,     # 256 MB
+    "busy_timeout": 60000,      # ms, distributed workers wait for each other's commits
+}
+DB_JOURNAL_MODE = "WAL"
+
+# Schema upgrades, applied in order on top of the tables created by
+# init_database. PRAGMA user_version holds the number of upgrades applied.
+SCHEMA_MIGRATIONS = [
+    # 1: one row per post, so INSERT OR IGNORE skips posts already saved, and
+    # indexes for lookups by forum and by thread. The unique index starts with
+    # thread_id, so it also serves lookups of a thread's messages.
+    [
+        """DELETE FROM messages WHERE id NOT IN (
+               SELECT MIN(id) FROM messages GROUP BY thread_id, post_number
+           )""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_thread_post ON messages (thread_id, post_number)",
+        "CREATE INDEX IF NOT EXISTS idx_threads_forum ON threads (forum_id)",
+    ],
+    # 2: leases of the distributed crawl's frontier items
+    [
+        "ALTER TABLE frontier ADD COLUMN lease_owner TEXT",
+        "ALTER TABLE frontier ADD COLUMN lease_expires REAL",
+    ],
+    # 3: compressed message content
+    [
+        '''CREATE TABLE content_dicts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codec TEXT,
+            data BLOB,
+            created_at REAL
+        )''',
+        "ALTER TABLE messages ADD COLUMN content_dict_id INTEGER REFERENCES content_dicts (id)",
+    ],
+    # 4: full-text index of messages, with their thread's title (see forum_search.py).
+    # It is contentless, as contents may be stored compressed, and filled by the
+    # writer; plain contents already stored are indexed here.
+    [
+        '''CREATE VIRTUAL TABLE messages_fts USING fts5 (
+            content, title, author,
+            content = '', tokenize = 'unicode61 remove_diacritics 2'
+        )''',
+        '''INSERT INTO messages_fts (rowid, content, title, author)
+        SELECT m.id, m.content, t.title, m.author
+        FROM messages m JOIN threads t ON t.id = m.thread_id
+        WHERE m.content_dict_id IS NULL''',
+    ],
+    # 5: dates as Unix timestamps, for range queries on the indexes. Stored
+    # relative dates ("Hier à 09:12") and dates without a year ("Mer 5 Juin -
+    # 8:40") can't be placed any more and stay NULL.
+    [
+        "ALTER TABLE messages ADD COLUMN post_ts INTEGER",
+        "ALTER TABLE threads ADD COLUMN last_ts INTEGER",
+        "UPDATE messages SET post_ts = forum_timestamp(post_date)",
+        "UPDATE threads SET last_ts = forum_timestamp(last_date)",
+        "CREATE INDEX idx_messages_post_ts ON messages (post_ts)",
+        "CREATE INDEX idx_threads_last_ts ON threads (last_ts)",
+    ],
+    # 6: site (host) of forums, threads and frontier items, for databases shared
+    # by several sites
+    [
+        "ALTER TABLE forums ADD COLUMN site TEXT",
+        "ALTER TABLE threads ADD COLUMN site TEXT",
+        "ALTER TABLE frontier ADD COLUMN site TEXT",
+        "UPDATE forums SET site = url_host(url)",
+        "UPDATE threads SET site = url_host(url)",
+        "UPDATE frontier SET site = url_host(url)",
+        "CREATE INDEX idx_forums_site ON forums (site)",
+        "CREATE INDEX idx_threads_site ON threads (site)",
+        "CREATE INDEX idx_frontier_site_status ON frontier (site, status)",
+    ],
+    # 7: what forum_publisher.py published on each Discord server (guild), so
+    # reruns only publish what is new. Empty posts are recorded without a
+    # Discord message; a post split in several parts maps to its first one.
+    [
+        '''CREATE TABLE discord_forums (
+            guild_id INTEGER,
+            forum_id INTEGER REFERENCES forums (id),
+            channel_id INTEGER,
+            published_at REAL,
+            PRIMARY KEY (guild_id, forum_id)
+        )''',
+        '''CREATE TABLE discord_threads (
+            guild_id INTEGER,
+            thread_id INTEGER REFERENCES threads (id),
+            channel_id INTEGER,
+            discord_thread_id INTEGER,
+            published_at REAL,
+            PRIMARY KEY (guild_id, thread_id)
+        )''',
+        '''CREATE TABLE discord_messages (
+            guild_id INTEGER,
+            message_id INTEGER REFERENCES messages (id),
+            discord_thread_id INTEGER,
+            discord_message_id INTEGER,
+            parts INTEGER,
+            published_at REAL,
+            PRIMARY KEY (guild_id, message_id)
+        )''',
+        "CREATE INDEX idx_discord_messages_thread ON discord_messages (guild_id, discord_thread_id)",
+    ],
+]
+
+def connect_db(db_path=DB_NAME):
+    """Open a database connection with the tuned pragmas"""
+    # The async crawl hands the connection over to a database thread, used by
+    # one thread at a time
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    for name, value in DB_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    conn.create_function("forum_timestamp", 1, stored_date_timestamp)
+    conn.create_function("url_host", 1, lambda url: urlparse(url).netloc.lower() if url else None)
+    return conn
+
+def stored_date_timestamp(text):
+    """Timestamp of a date stored earlier, unless it depended on the day it was
+    scraped: relative dates ("Hier à 09:12") and dates without a year"""
+    return parse_forum_date(text) if shows_year(text) else None
+
+def migrate_database(conn):
+    """Bring an existing database up to the latest schema version, in place"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, statements in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        print(f"Upgrading database schema to version {number}")
+        # Each upgrade is applied entirely or not at all
+        conn.execute("BEGIN")
+        for statement in statements:
+            conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+
+def check_replay_database(db_path=DB_NAME):
+    """Refuse to replay into an existing database, whose stored rows would be kept"""
+    if os.path.exists(db_path):
+        raise SystemExit(f"REPLAY_MODE rebuilds the database from scratch: move {db_path} away first,"
+                         f" or set DB_NAME to a new file")
+
+def init_database(db_path=DB_NAME):
     """Initialize SQLite database with required tables"""
-    conn = sqlite3.connect(DB_NAME)
+    conn = connect_db(db_path)
+    conn.execute(f"PRAGMA journal_mode = {DB_JOURNAL_MODE}")
     cursor = conn.cursor()
     
     # Create forums table
@@ -71,112 +681,515 @@ def init_database():
         )
     ''')
     
+    # Create crawl frontier table (work queue of the resumable crawl)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS frontier (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT,
+            url TEXT UNIQUE,
+            first_page INTEGER DEFAULT 1,
+            last_post_number INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            queued_at REAL,
+            started_at REAL,
+            finished_at REAL,
+            duration REAL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_frontier_status ON frontier (status)")
+    
     conn.commit()
+    migrate_database(conn)
     conn.close()
-    print(f"Database {DB_NAME} initialized successfully!")
+    print(f"Database {db_path} initialized successfully!")
+
+class DatabaseWriter:
+    """Saves scraped data over a single connection, grouping rows in transactions"""
+
+    def __init__(self, db_path=DB_NAME, commit_rows=COMMIT_ROWS, commit_interval=COMMIT_INTERVAL):
+        self.conn = connect_db(db_path)
+        self.commit_rows = commit_rows
+        self.commit_interval = commit_interval
+        self.pending_rows = 0
+        self.last_commit = time.monotonic()
+        self.codec = message_codec.load_codec(self.conn) if COMPRESS_CONTENT else None
+        # Site the saved forums and threads belong to
+        self.site = current_site.get().name
+        self.plain_messages = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @metrics.timed("db_write_seconds")
+    def save_forum(self, forum_data):
+        """Save forum data and return forum ID"""
+        # Upsert, so the forum keeps its ID and its threads stay attached
+        self.conn.execute('''
+            INSERT INTO forums 
+            (group_name, title, description, url, subjects, replies, site)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET
+                group_name = excluded.group_name, title = excluded.title,
+                description = excluded.description, subjects = excluded.subjects,
+                replies = excluded.replies
+        ''', (
+            forum_data["group"],
+            forum_data["title"],
+            forum_data["description"],
+            forum_data["url"],
+            forum_data["subjects"],
+            forum_data["replies"],
+            self.site
+        ))
+        self.rows_written(1)
+        return self.forum_id(forum_data["url"])
+
+    @metrics.timed("db_write_seconds")
+    def save_thread(self, thread_data, forum_id):
+        """Save thread data and return thread ID.
+
+        The reply count and last post are left to save_thread_stats.
+        """
+        # Upsert, so the thread keeps its ID and its messages stay attached
+        self.conn.execute('''
+            INSERT INTO threads 
+            (forum_id, title, url, author, views, site)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET
+                forum_id = excluded.forum_id, title = excluded.title, author = excluded.author,
+                views = excluded.views
+        ''', (
+            forum_id,
+            thread_data["title"],
+            thread_data["url"],
+            thread_data["author"],
+            thread_data["views"],
+            self.site
+        ))
+        self.rows_written(1)
+        return self.thread_id(thread_data["url"])
+
+    @metrics.timed("db_write_seconds")
+    def update_thread(self, thread_id, thread_data, forum_id):
+        """Refresh a stored thread's details, keeping its ID and messages"""
+        self.conn.execute('''
+            UPDATE threads
+            SET forum_id = ?, title = ?, author = ?, views = ?
+            WHERE id = ?
+        ''', (
+            forum_id,
+            thread_data["title"],
+            thread_data["author"],
+            thread_data["views"],
+            thread_id
+        ))
+        self.rows_written(1)
+
+    @metrics.timed("db_write_seconds")
+    def save_thread_stats(self, thread_id, thread_data):
+        """Store the reply count and last post listed for a thread.
+
+        Incremental crawls skip threads whose listed stats match the stored
+        ones, so they are saved once the thread's messages are.
+        """
+        self.conn.execute('''
+            UPDATE threads
+            SET replies = ?, last_date = ?, last_author = ?, last_ts = ?
+            WHERE id = ?
+        ''', (
+            thread_data["replies"],
+            thread_data["last_date"],
+            thread_data["last_author"],
+            parse_forum_date(thread_data["last_date"]),
+            thread_id
+        ))
+        self.rows_written(1)
+
+    def forum_id(self, url):
+        row = self.conn.execute("SELECT id FROM forums WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def thread_id(self, url):
+        row = self.conn.execute("SELECT id FROM threads WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def thread_replies(self, thread_id):
+        row = self.conn.execute("SELECT replies FROM threads WHERE id = ?", (thread_id,)).fetchone()
+        return row[0] if row else None
+
+    def thread_states(self):
+        """Stored details of every thread, with its last post number, by URL"""
+        cursor = self.conn.execute('''
+            SELECT t.id, t.url, t.replies, t.last_date, t.last_author, MAX(m.post_number)
+            FROM threads t
+            LEFT JOIN messages m ON m.thread_id = t.id
+            GROUP BY t.id
+        ''')
+        return {
+            url: {
+                "id": thread_id,
+                "replies": replies,
+                "last_date": last_date,
+                "last_author": last_author,
+                "last_post_number": last_post_number,
+            }
+            for thread_id, url, replies, last_date, last_author, last_post_number in cursor
+        }
+
+    @metrics.timed("db_write_seconds")
+    def save_messages(self, messages, thread_id):
+        """Save the messages of a thread in one statement, and index the new ones"""
+        if COMPRESS_CONTENT and self.codec is None:
+            self.train_codec(len(messages))
+        codec = self.codec
+        # Contents of the messages not saved yet, which are the ones to index
+        new_contents = {}
+        for message_data in messages:
+            new_contents.setdefault(message_data["post_number"], message_data["content"])
+        for post_number, in self.conn.execute(f'''
+            SELECT post_number FROM messages
+            WHERE thread_id = ? AND post_number IN ({", ".join("?" * len(new_contents))})
+        ''', (thread_id, *new_contents)):
+            del new_contents[post_number]
+        self.conn.executemany('''
+            INSERT OR IGNORE INTO messages 
+            (thread_id, author, content, post_date, post_number, content_dict_id, post_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(
+            thread_id,
+            message_data["author"],
+            codec.compress(message_data["content"]) if codec else message_data["content"],
+            message_data["post_date"],
+            message_data["post_number"],
+            codec.dict_id if codec else None,
+            parse_forum_date(message_data["post_date"])
+        ) for message_data in messages])
+        self.conn.executemany('''
+            INSERT INTO messages_fts (rowid, content, title, author)
+            SELECT m.id, ?, t.title, m.author
+            FROM messages m JOIN threads t ON t.id = m.thread_id
+            WHERE m.thread_id = ? AND m.post_number = ?
+        ''', [(content, thread_id, post_number) for post_number, content in new_contents.items()])
+        self.rows_written(len(messages))
+
+    def train_codec(self, count):
+        """Train the content dictionary once enough messages were saved plain"""
+        self.plain_messages += count
+        if self.plain_messages >= DICT_SAMPLE_MESSAGES:
+            self.commit()
+            self.codec = message_codec.create_codec(
+                self.conn, sample_size=DICT_SAMPLE_MESSAGES, min_samples=DICT_SAMPLE_MESSAGES // 2
+            )
+            self.plain_messages = 0
+            if self.codec:
+                self.commit()
+                print(f"Compressing messages with a {self.codec.codec} dictionary")
+
+    def rows_written(self, count):
+        """Commit once enough rows or enough time have accumulated"""
+        self.pending_rows += count
+        if (self.pending_rows >= self.commit_rows
+                or time.monotonic() - self.last_commit >= self.commit_interval):
+            self.commit()
+
+    @metrics.timed("db_write_seconds")
+    def commit(self):
+        self.conn.commit()
+        self.pending_rows = 0
+        self.last_commit = time.monotonic()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+class CrawlFrontier:
+    """Persistent work queue of the resumable crawl.
+
+    Items are the forum index ("index"), forum thread lists ("forum") and
+    threads ("thread"), going from pending to in_flight to done. An item in
+    flight is leased to the worker crawling it until its lease expires. The
+    frontier shares the writer's connection, so an item is marked done in the
+    same transaction as the rows it produced. Sites sharing a database each
+    have their own frontier, made of the items of their writer's site.
+    """
+
+    def __init__(self, writer, worker_id=None, max_attempts=FRONTIER_MAX_ATTEMPTS,
+                 lease_seconds=LEASE_SECONDS):
+        self.writer = writer
+        self.conn = writer.conn
+        self.site = writer.site
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+
+    def remaining(self):
+        """Number of items still to be crawled"""
+        return self.conn.execute('''
+            SELECT COUNT(*) FROM frontier
+            WHERE site = ? AND status != 'done' AND attempts < ?
+        ''', (self.site, self.max_attempts)).fetchone()[0]
+
+    def start_crawl(self):
+        """Queue the forum index if the previous crawl is over.
+
+        Returns whether a new crawl was started. Checking and queuing happen in
+        one write transaction, so workers starting together only seed once.
+        """
+        self.writer.commit()
+        self.conn.execute("BEGIN IMMEDIATE")
+        started = not self.remaining()
+        if started:
+            self.conn.execute("DELETE FROM frontier WHERE site = ?", (self.site,))
+            self.conn.execute('''
+                INSERT INTO frontier (kind, url, queued_at, site) VALUES ('index', ?, ?, ?)
+            ''', (current_site.get().base_url, time.time(), self.site))
+        self.writer.commit()
+        return started
+
+    def reset_in_flight(self):
+        """Put back items that were being crawled when the process stopped"""
+        self.conn.execute("UPDATE frontier SET status = 'pending' WHERE site = ? AND status = 'in_flight'",
+                          (self.site,))
+        self.writer.commit()
+
+    def enqueue(self, kind, url, first_page=1, last_post_number=0):
+        """Queue an item, unless it was already queued during this crawl"""
+        self.conn.execute('''
+            INSERT OR IGNORE INTO frontier (kind, url, first_page, last_post_number, queued_at, site)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (kind, url, first_page, last_post_number, time.time(), self.site))
+        self.writer.rows_written(1)
+
+    def claim(self):
+        """Lease the next pending item (or one whose lease expired) and return it, or None.
+
+        Threads come before thread lists so queued work is drained depth first.
+        """
+        self.writer.commit()
+        now = time.time()
+        # Lock the database for writing first, so no other worker claims the same item
+        self.conn.execute("BEGIN IMMEDIATE")
+        row = self.conn.execute('''
+            SELECT id, kind, url, first_page, last_post_number, attempts FROM frontier
+            WHERE site = ? AND attempts < ?
+              AND (status = 'pending' OR (status = 'in_flight' AND lease_expires < ?))
+            ORDER BY kind = 'forum', id
+            LIMIT 1
+        ''', (self.site, self.max_attempts, now)).fetchone()
+        if row is None:
+            self.writer.commit()
+            return None
+        item = dict(zip(("id", "kind", "url", "first_page", "last_post_number", "attempts"), row))
+        item["started_at"] = now
+        self.conn.execute('''
+            UPDATE frontier
+            SET status = 'in_flight', attempts = attempts + 1, started_at = ?,
+                lease_owner = ?, lease_expires = ?
+            WHERE id = ?
+        ''', (now, self.worker_id, now + self.lease_seconds, item["id"]))
+        self.writer.commit()
+        return item
+
+    def renew(self, item):
+        """Extend the lease of an item that is making progress"""
+        self.conn.execute('''
+            UPDATE frontier SET lease_expires = ? WHERE id = ? AND lease_owner = ?
+        ''', (time.time() + self.lease_seconds, item["id"], self.worker_id))
+        self.writer.rows_written(1)
+
+    def done(self, item):
+        finished_at = time.time()
+        cursor = self.conn.execute('''
+            UPDATE frontier SET status = 'done', finished_at = ?, duration = ?
+            WHERE id = ? AND lease_owner = ?
+        ''', (finished_at, finished_at - item["started_at"], item["id"], self.worker_id))
+        if not cursor.rowcount:
+            print(f"Lease on {item['url']} was lost to another worker")
+        self.writer.commit()
+
+    def retry(self, item):
+        self.conn.execute('''
+            UPDATE frontier SET status = 'pending' WHERE id = ? AND lease_owner = ?
+        ''', (item["id"], self.worker_id))
+        self.writer.commit()
+
+class PageCache:
+    """Content-addressed store of raw pages.
+
+    Page bodies are gzipped under blobs/, named after the SHA-256 of their
+    content, so identical pages are stored once. index.db maps each URL to its
+    current body and the validators used to revalidate it.
+    """
+
+    def __init__(self, cache_dir=PAGE_CACHE_DIR):
+        self.blob_dir = os.path.join(cache_dir, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        # Pages are fetched from several threads
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(cache_dir, "index.db"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                digest TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL
+            )
+        ''')
+        self.conn.commit()
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest + ".html.gz")
+
+    def get(self, url):
+        """Cached page as a dict with its html, etag and last_modified, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT digest, etag, last_modified FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        digest, etag, last_modified = row
+        try:
+            with gzip.open(self.blob_path(digest), "rt", encoding="utf-8") as f:
+                html = f.read()
+        except FileNotFoundError:
+            return None
+        return {"html": html, "etag": etag, "last_modified": last_modified}
+
+    def put(self, url, html, etag=None, last_modified=None):
+        data = html.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write aside then rename, so a crash never leaves a truncated blob
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        with self.lock:
+            self.conn.execute('''
+                INSERT OR REPLACE INTO pages (url, digest, etag, last_modified, fetched_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (url, digest, etag, last_modified, time.time()))
+            self.conn.commit()
+
+page_cache = PageCache() if PAGE_CACHE or REPLAY_MODE else None
 
 def save_forum_to_db(forum_data):
     """Save forum data to database and return forum ID"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT OR REPLACE INTO forums 
-        (group_name, title, description, url, subjects, replies)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        forum_data["group"],
-        forum_data["title"],
-        forum_data["description"],
-        forum_data["url"],
-        forum_data["subjects"],
-        forum_data["replies"]
-    ))
-    
-    forum_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return forum_id
+    with DatabaseWriter() as writer:
+        return writer.save_forum(forum_data)
 
 def save_thread_to_db(thread_data, forum_id):
     """Save thread data to database and return thread ID"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT OR REPLACE INTO threads 
-        (forum_id, title, url, author, replies, views, last_date, last_author)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        forum_id,
-        thread_data["title"],
-        thread_data["url"],
-        thread_data["author"],
-        thread_data["replies"],
-        thread_data["views"],
-        thread_data["last_date"],
-        thread_data["last_author"]
-    ))
-    
-    thread_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return thread_id
+    with DatabaseWriter() as writer:
+        thread_id = writer.save_thread(thread_data, forum_id)
+        writer.save_thread_stats(thread_id, thread_data)
+        return thread_id
 
 def save_message_to_db(message_data, thread_id):
     """Save message data to database"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT OR IGNORE INTO messages 
-        (thread_id, author, content, post_date, post_number)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (
-        thread_id,
-        message_data["author"],
-        message_data["content"],
-        message_data["post_date"],
-        message_data["post_number"]
-    ))
-    
-    conn.commit()
-    conn.close()
+    with DatabaseWriter() as writer:
+        writer.save_messages([message_data], thread_id)
 
 def login():
+    site = current_site.get()
     # Get login page to retrieve CSRF token
-    r = session.get(LOGIN_PAGE)
+    r = throttled_get(site.login_page)
     r.raise_for_status()
-    soup = BeautifulSoup(r.text, "html.parser")
+    soup = make_soup(r.text, "login")
 
     csrf_token = soup.find("input", {"name": "_csrf_token"})["value"]
 
     # Build payload exactly like the form
     payload = {
-        "_username": USERNAME,
-        "_password": PASSWORD,
+        "_username": site.username,
+        "_password": site.password,
         "_remember_me": "on",      # optional
         "_csrf_token": csrf_token,
         "_submit": "Connexion",    # matches the submit button value
     }
-    
-    print("payload", payload)
 
     # POST credentials
-    r = session.post(LOGIN_POST, data=payload)
+    r = site.session.post(site.login_post, data=payload)
     r.raise_for_status()
 
     # Check login success (your username should appear in HTML somewhere)
     if "Mon profil" not in r.text:
         raise RuntimeError("Login failed, check credentials")
-    print("Logged in successfully!")
+    print(f"Logged in successfully to {site.name}!")
+    metrics.count("logins")
+
+def save_session():
+    """Save the session cookies for the next runs, readable by this user only"""
+    site = current_site.get()
+    jar = LWPCookieJar()
+    for cookie in site.session.cookies:
+        jar.set_cookie(cookie)
+    # The jar creates the file with mode 0600; login cookies without an expiry
+    # are kept too, they are what holds the session
+    tmp_path = site.session_file + ".tmp"
+    jar.save(tmp_path, ignore_discard=True)
+    os.replace(tmp_path, site.session_file)
+
+def load_session():
+    """Restore the cookies of a previous run, returning whether any is still valid"""
+    site = current_site.get()
+    cookies = LWPCookieJar()
+    try:
+        # Expired cookies are left out
+        cookies.load(site.session_file, ignore_discard=True)
+    except OSError:  # LoadError included
+        return False
+    if not len(cookies):
+        return False
+    site.session.cookies.update(cookies)
+    return True
+
+def restore_session():
+    """Reuse the saved session, or log in if there is none"""
+    if load_session():
+        print(f"Reusing the session saved in {current_site.get().session_file}")
+        return
+    login()
+    save_session()
+
+def is_login_page(r):
+    """Whether the forum answered with its login form, i.e. the session expired"""
+    return r.url.startswith(current_site.get().login_page) or 'name="_password"' in r.text
+
+def renew_session(generation):
+    """Log in again after an expired session was seen by a request sent at generation.
+
+    Requests failing together only cause one login: those sent before the
+    session was renewed just retry with the new one.
+    """
+    site = current_site.get()
+    with site.login_lock:
+        if site.login_generation != generation:
+            return
+        print(f"Session of {site.name} expired, logging in again")
+        metrics.count("session_expired")
+        site.session.cookies.clear()
+        login()
+        save_session()
+        site.login_generation += 1
 
 
 def get_forums():
-    r = session.get(BASE_URL)   # after login
-    r.raise_for_status()
-    soup = BeautifulSoup(r.text, "html.parser")
+    html = fetch_html(current_site.get().base_url)   # after login
+    with metrics.timer("parse_get_forums_seconds"):
+        return parse_forums(make_soup(html, "forums"))
 
+def parse_forums(soup):
+    """Extract the forums listed on the forum index"""
     forums = []
 
     # Loop over each forum group
@@ -188,7 +1201,7 @@ def get_forums():
             if not forum_link:
                 continue
 
-            forum_url = BASE_URL + forum_link["href"]
+            forum_url = current_site.get().base_url + forum_link["href"]
             forum_title = forum_link.get_text(strip=True)
             forum_desc = forum_row.find("div", class_="forumdesc").get_text(strip=True)
 
@@ -235,228 +1248,998 @@ def get_max_pages(soup):
         max_page = max(numbers)
     return max_page
 
-def get_threads(forum_url, max_pages=None):
-    threads = []
-    page = 1
+def forum_page_url(forum_url, page):
+    """Build the URL of a given page of a forum's thread list"""
+    if page == 1:
+        return forum_url
+    # Pattern: liste-XXXXXX-XXXXXX-[page]-[title].html
+    return re.sub(r"(liste-\d+-\d+)-(\d+)-(.*)\.html$", f"\\1-{page}-\\3.html", forum_url)
+
+def thread_page_url(thread_url, page):
+    """Build the URL of a given page of a thread"""
+    if page == 1:
+        return thread_url
+    # When multiple pages exist, it's like for list of threads:
+    # Example: http://foo.free-bb.com/sujet-xxxxxx-xxxxxx-xxxxx-1,
+    # http://foo.free-bb.com/sujet-xxxxxx-xxxxxx-xxxxx-2
+    # Pattern: sujet-XXXXXX-XXXXXX-XXXXX-[page]-[title].html
+    return re.sub(r"(sujet-\d+-\d+-\d+)-(\d+)-(.*)\.html$", f"\\1-{page}-\\3.html", thread_url)
+
+def css_classes(*names):
+    """Match a class attribute containing any of the given classes"""
+    return re.compile(r"(^|\s)(%s)(\s|$)" % "|".join(map(re.escape, names)))
+
+# Parts of each kind of page the scraper reads. Everything else (headers,
+# sidebars, ads, scripts...) is skipped by the parser when PARTIAL_PARSING is on.
+PAGE_REGIONS = {
+    "login": SoupStrainer("input", attrs={"name": "_csrf_token"}),
+    "forums": SoupStrainer("div", class_=css_classes("containerGroup")),
+    "threads": SoupStrainer(["div", "ul"], class_=css_classes("forum-row", "pagination")),
+    # Posts and their content are sibling rows, so keep whole rows
+    "messages": SoupStrainer(["div", "ul"], class_=css_classes("row", "pagination")),
+}
+
+def make_soup(html, region=None):
+    """Parse a page with the configured backend, only keeping the given region if partial parsing is on"""
+    parse_only = PAGE_REGIONS[region] if PARTIAL_PARSING and region else None
+    return BeautifulSoup(html, PARSER_BACKEND, parse_only=parse_only)
+
+def fetch_html(url):
+    """Fetch a page on the shared session, going through the page cache if enabled"""
+    if REPLAY_MODE:
+        cached = page_cache.get(url)
+        if cached is None:
+            raise LookupError(f"Page not in cache: {url}")
+        return cached["html"]
+
+    cached = page_cache.get(url) if PAGE_CACHE else None
+    headers = {}
+    if cached:
+        # Only download the page again if it changed
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    site = current_site.get()
+    # A busy site can expire the new session again before the page is retried
+    for attempt in range(FETCH_RETRIES + 1):
+        generation = site.login_generation
+        r = throttled_get(url, headers)
+        if not (r.ok and is_login_page(r)):
+            break
+        if attempt == FETCH_RETRIES:
+            raise RuntimeError(f"Still logged out after logging in again: {url}")
+        renew_session(generation)
+    if cached and r.status_code == 304:
+        metrics.count("http_not_modified")
+        return cached["html"]
+    if 400 <= r.status_code < 500 and r.status_code != 429:
+        metrics.count("http_errors")
+    r.raise_for_status()
 
-    while True:
-        # replace the page number in the URL if page > 1
-        if page == 1:
-            url = forum_url
-        else:
-            # Pattern: sujet-XXXXXX-XXXXXX-XXXXX-[page]-[title].html
-            url = re.sub(r"(liste-\d+-\d+)-(\d+)-(.*)\.html$", f"\\1-{page}-\\3.html", forum_url)
+    if PAGE_CACHE:
+        page_cache.put(url, r.text, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+    return r.text
+
+def fetch_soup(url, region=None):
+    """Fetch a page and parse it"""
+    return make_soup(fetch_html(url), region)
+
+def parse_thread_list_page(html, base_url=None):
+    """Parse a page of a forum's thread list into plain data"""
+    soup = make_soup(html, "threads")
+    return {
+        "total_pages": get_max_pages(soup),
+        "has_rows": bool(soup.select("div.row.forum-row")),
+        "threads": parse_thread_rows(soup, base_url),
+    }
 
-        r = session.get(url)
-        r.raise_for_status()
-        soup = BeautifulSoup(r.text, "html.parser")
+def parse_thread_page(html, base_url=None):
+    """Parse a thread page into plain data, posts being numbered from 1"""
+    soup = make_soup(html, "messages")
+    messages, post_count = parse_message_posts(soup)
+    return {
+        "total_pages": get_max_pages(soup),
+        "messages": messages,
+        "post_count": post_count,
+    }
 
-        # detect total number of pages (once)
-        if page == 1:
-            total_pages = get_max_pages(soup)
-            if max_pages is not None:
-                total_pages = min(total_pages, max_pages)
+PAGE_PARSERS = {
+    "threads": parse_thread_list_page,
+    "messages": parse_thread_page,
+}
+
+parse_pool = None
+parse_pool_lock = threading.Lock()
+
+def configure_parser(backend, partial_parsing):
+    """Parse pool initializer: use the parent's parser settings"""
+    global PARSER_BACKEND, PARTIAL_PARSING
+    PARSER_BACKEND = backend
+    PARTIAL_PARSING = partial_parsing
+
+def get_parse_pool():
+    global parse_pool
+    with parse_pool_lock:
+        if parse_pool is None:
+            parse_pool = ProcessPoolExecutor(
+                max_workers=PARSE_PROCESSES,
+                initializer=configure_parser,
+                initargs=(PARSER_BACKEND, PARTIAL_PARSING),
+            )
+        return parse_pool
+
+def submit_parse(html, kind):
+    """Parse a page in the parse pool, returning the future of the parsed page"""
+    # Links are resolved against the site's URL, unknown to the parse pool
+    base_url = current_site.get().base_url
+    start = time.perf_counter()
+    future = get_parse_pool().submit(PAGE_PARSERS[kind], html, base_url)
+    future.add_done_callback(
+        lambda future: metrics.observe(f"parse_get_{kind}_seconds", time.perf_counter() - start)
+    )
+    return future
+
+def parse_page(html, kind):
+    """Parse a thread list ("threads") or thread ("messages") page, in the parse pool if enabled"""
+    if PARSE_PROCESSES:
+        return submit_parse(html, kind).result()
+    # Named after the scraping function the page is parsed for
+    with metrics.timer(f"parse_get_{kind}_seconds"):
+        return PAGE_PARSERS[kind](html, current_site.get().base_url)
+
+def fetch_page(url, kind):
+    """Fetch a thread list or thread page and parse it into plain data"""
+    return parse_page(fetch_html(url), kind)
+
+def fetch_page_parsing(url, kind):
+    """Fetch a page and hand it to the parse pool, if enabled, without waiting.
+
+    Returns the future of the parsed page, or the parsed page without a parse
+    pool: see parsed(). The calling I/O thread can go on downloading.
+    """
+    html = fetch_html(url)
+    if PARSE_PROCESSES:
+        return submit_parse(html, kind)
+    return parse_page(html, kind)
+
+def parsed(page):
+    """Page returned by fetch_page_parsing, once parsed"""
+    return page.result() if isinstance(page, Future) else page
+
+def remaining_page_urls(page, url, page_url, max_pages=None, first_page=1):
+    """URLs of the pages after first_page, up to the last page of the pagination"""
+    total_pages = page["total_pages"]
+    if max_pages is not None:
+        total_pages = min(total_pages, max_pages)
+    return [page_url(url, page) for page in range(first_page + 1, total_pages + 1)]
+
+def predicted_pages(replies, first_page=1, max_pages=None):
+    """Last page of a thread expected from its reply count, or first_page if unknown"""
+    if not PREDICT_PAGES or replies is None:
+        return first_page
+    last_page = max(replies // POSTS_PER_PAGE + 1, first_page)
+    return min(last_page, max_pages) if max_pages is not None else last_page
+
+def check_prediction(predicted, first_page, urls):
+    """Count predictions of the last page, and those page 1 proved wrong"""
+    if PREDICT_PAGES:
+        metrics.count("page_predictions")
+        if predicted != first_page + len(urls):
+            metrics.count("page_predictions_missed")
+
+def fetch_pages(urls, kind):
+    """Fetch pages PAGE_WORKERS at a time, yielding them parsed in the order of urls.
+
+    Fetching only runs PAGE_WORKERS pages ahead of the caller, so at most that
+    many parsed pages are held in memory whatever the number of pages. A page
+    failing with a retryable error is queued again behind the pages already
+    submitted, up to PAGE_REQUEUES times, before giving up. With a parse pool,
+    the I/O threads hand pages over to it and go on downloading, PARSE_PROCESSES
+    more pages being let ahead for the pages being parsed.
+    """
+    if not urls:
+        return
+    if profiling:
+        yield from (fetch_page(url, kind) for url in urls)
+        return
+    urls = iter(urls)
+    executor = ThreadPoolExecutor(max_workers=PAGE_WORKERS)
+    pending = deque((url, submit_in_context(executor, fetch_page_parsing, url, kind), 0)
+                    for url in islice(urls, PAGE_WORKERS + PARSE_PROCESSES))
+    try:
+        while pending:
+            url, future, requeues = pending[0]
+            try:
+                page = future.result()
+            except Exception as e:
+                if requeues >= PAGE_REQUEUES or not is_retryable(e):
+                    raise
+                metrics.count("page_requeues")
+                pending[0] = (url, submit_in_context(executor, fetch_page_parsing, url, kind), requeues + 1)
+                continue
+            page = parsed(page)
+            pending.popleft()
+            for next_url in islice(urls, 1):
+                pending.append((next_url, submit_in_context(executor, fetch_page_parsing, next_url, kind), 0))
+            yield page
+    finally:
+        # Stop pending fetches if the caller stops early (error, empty page...)
+        executor.shutdown(cancel_futures=True)
+
+# Query parameters carrying a session, which vary between listings of a thread
+SESSION_PARAMS = {"sid", "phpsessid"}
+
+def normalize_thread_url(href, base_url):
+    """Canonical URL of a thread linked from a forum's list, the same from any listing"""
+    parts = urlparse(urljoin(base_url, href))
+    query = "&".join(
+        param for param in parts.query.split("&")
+        if param and param.split("=")[0].lower() not in SESSION_PARAMS
+    )
+    # Force links to the first page, the #numN anchor of the last post being dropped.
+    # Example: http://foo.free-bb.com/sujet-xxxxxx-xxxxxx-xxxxx-2-bar.html
+    # becomes http://foo.free-bb.com/sujet-xxxxxx-xxxxxx-xxxxxx-1-bar.html
+    # Pattern: sujet-XXXXXX-XXXXXX-XXXXX-[page]-[title].html
+    path = re.sub(r"(sujet-\d+-\d+-\d+)-(\d+)-(.*)\.html$", r"\1-1-\3.html", parts.path)
+    return urlunparse((parts.scheme.lower(), parts.netloc.lower(), path, parts.params, query, ""))
+
+def parse_thread_rows(soup, base_url=None):
+    """Extract the threads listed on one page of a forum of the site at base_url"""
+    base_url = base_url or current_site.get().base_url
+    threads = []
 
-        rows = soup.select("div.row.forum-row")
-        if not rows:
-            break
+    for row in soup.select("div.row.forum-row"):
+        link = row.select_one("div.tclcon a[href]")
+        if not link:
+            continue
+        thread_url = normalize_thread_url(link["href"], base_url)
 
-        for row in rows:
-            link = row.select_one("div.tclcon a[href]")
-            if not link:
-                continue
-            thread_url = urljoin(BASE_URL, link["href"])
-
-            # Strip out #numN from URL if present
-            thread_url = re.sub(r"#num\d+$", "", thread_url)
-
-            # Force links to the first page.
-            # Example: http://foo.free-bb.com/sujet-xxxxxx-xxxxxx-xxxxx-2-bar.html
-            # becomes http://foo.free-bb.com/sujet-xxxxxx-xxxxxx-xxxxxx-1-bar.html
-            # Pattern: sujet-XXXXXX-XXXXXX-XXXXX-[page]-[title].html
-            thread_url = re.sub(r"(sujet-\d+-\d+-\d+)-(\d+)-(.*)\.html$", f"\\1-1-\\3.html", thread_url)
-
-            title = link.get_text(strip=True)
-
-            author_tag = row.select_one("div.tclcon a[itemprop='author']")
-            author = author_tag.get_text(strip=True) if author_tag else None
-
-            replies = views = None
-            stats = row.select_one("div[itemprop='interactionStatistic']")
-            if stats:
-                strongs = stats.find_all("strong")
-                if len(strongs) >= 2:
-                    try:
-                        replies = int(strongs[0].get_text(strip=True))
-                        views = int(strongs[1].get_text(strip=True))
-                    except ValueError:
-                        pass
-
-            lastpost = row.select_one("div.lastpostlink")
-            last_date = last_author = None
-            if lastpost:
-                time_tag = lastpost.find("time")
-                if time_tag:
-                    last_date = time_tag.get_text(strip=True)
-                user_tag = lastpost.select_one("span.byuser a")
-                if user_tag:
-                    last_author = user_tag.get_text(strip=True)
-
-            threads.append({
-                "title": title,
-                "url": thread_url,
-                "author": author,
-                "replies": replies,
-                "views": views,
-                "last_date": last_date,
-                "last_author": last_author,
-            })
+        title = link.get_text(strip=True)
 
-        if page >= total_pages:
-            break
-        page += 1
+        author_tag = row.select_one("div.tclcon a[itemprop='author']")
+        author = author_tag.get_text(strip=True) if author_tag else None
+
+        replies = views = None
+        stats = row.select_one("div[itemprop='interactionStatistic']")
+        if stats:
+            strongs = stats.find_all("strong")
+            if len(strongs) >= 2:
+                try:
+                    replies = int(strongs[0].get_text(strip=True))
+                    views = int(strongs[1].get_text(strip=True))
+                except ValueError:
+                    pass
+
+        lastpost = row.select_one("div.lastpostlink")
+        last_date = last_author = None
+        if lastpost:
+            time_tag = lastpost.find("time")
+            if time_tag:
+                last_date = time_tag.get_text(strip=True)
+            user_tag = lastpost.select_one("span.byuser a")
+            if user_tag:
+                last_author = user_tag.get_text(strip=True)
+
+        threads.append({
+            "title": title,
+            "url": thread_url,
+            "author": author,
+            "replies": replies,
+            "views": views,
+            "last_date": last_date,
+            "last_author": last_author,
+        })
 
     return threads
-    
-def get_messages(thread_url, max_pages=None):
-    """Scrape all messages from a thread"""
+
+def thread_pages(pages, seen=None):
+    """Yield the threads of a forum's parsed list pages, page by page.
+
+    Threads whose URL is in seen, the threads listed so far in this forum by
+    default, are left out: sticky threads are listed on every page.
+    """
+    seen = set() if seen is None else seen
+    for page in pages:
+        if not page["has_rows"]:
+            break
+        threads = []
+        for thread in page["threads"]:
+            if thread["url"] in seen:
+                metrics.count("duplicate_threads")
+                continue
+            seen.add(thread["url"])
+            threads.append(thread)
+        yield threads
+
+def collect_threads(pages, seen=None):
+    """Threads of a forum's parsed list pages, in page order"""
+    return list(chain.from_iterable(thread_pages(pages, seen)))
+
+def iter_thread_pages(forum_url, max_pages=None, seen=None):
+    """Scrape the threads of a forum, yielding them page by page as pages come in"""
+    def pages():
+        # Page 1 gives the total number of pages, the others are fetched in parallel
+        page = fetch_page(forum_url, "threads")
+        yield page
+        urls = remaining_page_urls(page, forum_url, forum_page_url, max_pages)
+        yield from fetch_pages(urls, "threads")
+
+    return thread_pages(pages(), seen)
+
+def get_threads(forum_url, max_pages=None, seen=None):
+    return list(chain.from_iterable(iter_thread_pages(forum_url, max_pages, seen)))
+
+def parse_message_posts(soup, total_post_count=0):
+    """Extract the messages of one thread page.
+
+    Posts are numbered from total_post_count + 1. Returns the messages and the
+    number of posts found on the page (ads included, as they use a post slot).
+    """
     messages = []
-    page = 1
-    total_post_count = 0  # Track total posts across all pages
 
-    while True:
-        # Build URL with page number
-        if page == 1:
-            url = thread_url
-        else:
-            # When multiple pages exist, it's like for list of threads:
-            # Example: http://foo.free-bb.com/sujet-xxxxxx-xxxxxx-xxxxx-1,
-            # http://foo.free-bb.com/sujet-xxxxxx-xxxxxx-xxxxx-2
-            # Pattern: sujet-XXXXXX-XXXXXX-XXXXX-[page]-[title].html
-            url = re.sub(r"(sujet-\d+-\d+-\d+)-(\d+)-(.*)\.html$", f"\\1-{page}-\\3.html", thread_url)
+    # Find all message containers - look for the first post and regular posts
+    # First post has class "firstpost topPost", regular posts have "topPost"
+    first_post = soup.select_one("div.row.firstpost.topPost")
+    regular_posts = soup.select("div.row.topPost:not(.firstpost)")
+
+    all_posts = []
+    if first_post:
+        all_posts.append(first_post)
+    all_posts.extend(regular_posts)
+
+    for post_num, post_container in enumerate(all_posts, start=total_post_count + 1):
+        # Extract author from the author column
+        author_elem = post_container.select_one("div.author a h4")
+        if not author_elem:
+            author_elem = post_container.select_one("div.author h4")
+        author = author_elem.get_text(strip=True) if author_elem else "Unknown"
+
+        # Extract post date from the calendar div
+        date_elem = post_container.select_one("div.calendar")
+        post_date = "Unknown"
+        if date_elem:
+            date_text = date_elem.get_text(strip=True)
+            # Remove the calendar icon text and get just the date
+            post_date = date_text.replace("", "").strip()
+
+        # Extract message content from the next row's col-md-9
+        content = ""
+        next_row = post_container.find_next_sibling("div", class_="row")
+        if next_row:
+            content_elem = next_row.select_one("div.col-md-9")
+            if content_elem:
+                # Check if it's a reply div (has class like "reply5950509")
+                reply_div = content_elem.select_one("div[class^='reply']")
+                if reply_div:
+                    content = reply_div.get_text(strip=True)
+                else:
+                    # For first post, content is directly in the col-md-9
+                    # Remove any script tags and ads
+                    for script in content_elem.select("script, ins"):
+                        script.decompose()
+                    content = content_elem.get_text(strip=True)
+
+        # Skip if this is an ad row (contains google ads)
+        if "google_ad_client" in content or "Liens sponsorisés" in content:
+            continue
 
-        try:
-            r = session.get(url)
-            r.raise_for_status()
-            soup = BeautifulSoup(r.text, "html.parser")
-
-            # Detect total number of pages (once)
-            if page == 1:
-                total_pages = get_max_pages(soup)
-                if max_pages is not None:
-                    total_pages = min(total_pages, max_pages)
-
-            # Find all message containers - look for the first post and regular posts
-            # First post has class "firstpost topPost", regular posts have "topPost"
-            first_post = soup.select_one("div.row.firstpost.topPost")
-            regular_posts = soup.select("div.row.topPost:not(.firstpost)")
-            
-            all_posts = []
-            if first_post:
-                all_posts.append(first_post)
-            all_posts.extend(regular_posts)
-            
-            if not all_posts:
+        messages.append({
+            "author": author,
+            "content": content,
+            "post_date": post_date,
+            "post_number": post_num
+        })
+
+    return messages, len(all_posts)
+
+def message_pages(thread_url, pages, first_page=1):
+    """Yield the messages of a thread's parsed pages, page by page.
+
+    A page that fails to download stops the thread: its error is raised once
+    the messages of the pages before it were yielded.
+    """
+    page = first_page
+    total_post_count = (first_page - 1) * POSTS_PER_PAGE  # Track total posts across all pages
+
+    try:
+        # Pages come in order, so post numbers follow on from one page to the next
+        for parsed in pages:
+            if not parsed["post_count"]:
                 print(f"No posts found on page {page} of {thread_url}")
                 break
 
-            for post_num, post_container in enumerate(all_posts, start=total_post_count + 1):
-                # Extract author from the author column
-                author_elem = post_container.select_one("div.author a h4")
-                if not author_elem:
-                    author_elem = post_container.select_one("div.author h4")
-                author = author_elem.get_text(strip=True) if author_elem else "Unknown"
-
-                # Extract post date from the calendar div
-                date_elem = post_container.select_one("div.calendar")
-                post_date = "Unknown"
-                if date_elem:
-                    date_text = date_elem.get_text(strip=True)
-                    # Remove the calendar icon text and get just the date
-                    post_date = date_text.replace("", "").strip()
-
-                # Extract message content from the next row's col-md-9
-                content = ""
-                next_row = post_container.find_next_sibling("div", class_="row")
-                if next_row:
-                    content_elem = next_row.select_one("div.col-md-9")
-                    if content_elem:
-                        # Check if it's a reply div (has class like "reply5950509")
-                        reply_div = content_elem.select_one("div[class^='reply']")
-                        if reply_div:
-                            content = reply_div.get_text(strip=True)
-                        else:
-                            # For first post, content is directly in the col-md-9
-                            # Remove any script tags and ads
-                            for script in content_elem.select("script, ins"):
-                                script.decompose()
-                            content = content_elem.get_text(strip=True)
-
-                # Skip if this is an ad row (contains google ads)
-                if "google_ad_client" in content or "Liens sponsorisés" in content:
-                    continue
-
-                messages.append({
-                    "author": author,
-                    "content": content,
-                    "post_date": post_date,
-                    "post_number": post_num
-                })
+            # Pages are parsed on their own, with posts numbered from 1
+            page_messages = parsed["messages"]
+            for message in page_messages:
+                message["post_number"] += total_post_count
+            yield page_messages
 
             # Update total post count for next page
-            total_post_count += len(all_posts)
-
-            if page >= total_pages:
-                break
+            total_post_count += parsed["post_count"]
             page += 1
 
-        except Exception as e:
-            print(f"Error scraping page {page} of thread {thread_url}: {e}")
-            break
+    except Exception as e:
+        print(f"Error scraping page {page} of thread {thread_url}: {e}")
+        raise
+
+def collect_messages(thread_url, pages, first_page=1):
+    """Messages of a thread's parsed pages, in page order"""
+    return list(chain.from_iterable(message_pages(thread_url, pages, first_page)))
 
-    return messages
+def iter_message_pages(thread_url, max_pages=None, first_page=1, replies=None):
+    """Scrape the messages of a thread, yielding them page by page as pages come in.
+
+    With the thread's reply count, its predicted pages are all fetched in
+    parallel with the first one.
+    """
+    def pages():
+        predicted = predicted_pages(replies, first_page, max_pages)
+        fetched = fetch_pages([thread_page_url(thread_url, page) for page in range(first_page, predicted + 1)],
+                              "messages")
+        try:
+            # The first page gives the total number of pages
+            page = next(fetched)
+            yield page
+            urls = remaining_page_urls(page, thread_url, thread_page_url, max_pages, first_page)
+            check_prediction(predicted, first_page, urls)
+            # Pages predicted past the last page are dropped...
+            yield from islice(fetched, min(len(urls), predicted - first_page))
+        finally:
+            fetched.close()
+        # ...and the pages the prediction missed are fetched now
+        yield from fetch_pages(urls[predicted - first_page:], "messages")
+
+    return message_pages(thread_url, pages(), first_page)
+
+def get_messages(thread_url, max_pages=None, first_page=1, replies=None):
+    """Scrape all messages from a thread, or from first_page onwards"""
+    return list(chain.from_iterable(iter_message_pages(thread_url, max_pages, first_page, replies)))
+
+def save_message_pages(writer, thread_url, thread_id, first_page=1, last_post_number=0, on_page=None,
+                       replies=None):
+    """Scrape a thread and save its messages page by page, returning how many were saved.
+
+    Messages numbered up to last_post_number are already stored and skipped.
+    on_page, if given, is called after each saved page.
+    """
+    saved = 0
+    for messages in iter_message_pages(thread_url, first_page=first_page, replies=replies):
+        messages = [m for m in messages if m["post_number"] > last_post_number]
+        writer.save_messages(messages, thread_id)
+        saved += len(messages)
+        if on_page:
+            on_page()
+    return saved
+
+def resume_point(thread, state):
+    """Where to resume scraping a thread already in the database.
+
+    Returns the page to start from and the number of the last stored post, or
+    None when the thread list shows no new post since the last crawl and the
+    stored posts reach the listed reply count. Views alone are not a reason
+    to re-scrape.
+    """
+    last_post_number = state["last_post_number"]
+    if last_post_number is None:
+        return 1, 0
+    if (thread["replies"], thread["last_date"], thread["last_author"]) == \
+            (state["replies"], state["last_date"], state["last_author"]) \
+            and last_post_number >= (thread["replies"] or 0) + 1:
+        return None
+    # Re-fetch the page of the last stored post, it may have been completed since
+    return (last_post_number - 1) // POSTS_PER_PAGE + 1, last_post_number
+
+async def fetch_page_async(url, limiter, kind):
+    """Fetch and parse a page in a worker thread, within the global request limit.
+
+    A page failing with a retryable error is queued again for the limiter, up
+    to PAGE_REQUEUES times. A page handed to the parse pool is waited for
+    outside the limit, so the worker thread and the limit go to other requests.
+    """
+    for requeues in range(PAGE_REQUEUES + 1):
+        try:
+            async with limiter:
+                page = await asyncio.to_thread(fetch_page_parsing, url, kind)
+            break
+        except Exception as e:
+            if requeues == PAGE_REQUEUES or not is_retryable(e):
+                raise
+            metrics.count("page_requeues")
+    if isinstance(page, Future):
+        page = await asyncio.wrap_future(page)
+    return page
+
+async def iter_pages_async(url, page_url, kind, limiter, max_pages=None, first_page=1, predicted=None):
+    """Fetch the pages of a forum or thread concurrently, yielding them parsed and in order.
+
+    Pages up to predicted are fetched along with the first one, which gives the
+    number of pages. Fetching only runs PAGE_WORKERS pages ahead of the page
+    yielded, so pages don't pile up in memory while the consumer is busy. A
+    failed page raises its error once the pages before it were yielded.
+    """
+    predicting = predicted is not None
+    predicted = predicted or first_page
+    urls = [page_url(url, page) for page in range(first_page, predicted + 1)]
+    tasks = deque()
+    queued = 0
+
+    def fetch_ahead():
+        nonlocal queued
+        while len(tasks) < PAGE_WORKERS and queued < len(urls):
+            tasks.append(asyncio.ensure_future(fetch_page_async(urls[queued], limiter, kind)))
+            queued += 1
+
+    try:
+        fetch_ahead()
+        page = await tasks.popleft()
+        remaining = remaining_page_urls(page, url, page_url, max_pages, first_page)
+        if predicting:
+            check_prediction(predicted, first_page, remaining)
+        # Predicted pages past the last page are dropped, missing ones fetched next
+        urls = urls[:1] + remaining
+        while queued > len(urls):
+            tasks.pop().cancel()
+            queued -= 1
+        yield page
+        while tasks or queued < len(urls):
+            fetch_ahead()
+            yield await tasks.popleft()
+    finally:
+        for task in tasks:
+            if not task.cancel() and not task.cancelled():
+                task.exception()  # Retrieved, so it isn't reported as never retrieved
+
+async def get_threads_async(forum_url, limiter, max_pages=None, seen=None):
+    async with aclosing(iter_pages_async(forum_url, forum_page_url, "threads", limiter, max_pages)) as pages:
+        return collect_threads([page async for page in pages], seen)
+
+async def iter_messages_async(thread_url, limiter, max_pages=None, first_page=1, replies=None):
+    """Scrape the messages of a thread, yielding them page by page as pages come in.
+
+    The async counterpart of iter_message_pages: a failed page raises its
+    error once the messages of the pages before it were yielded.
+    """
+    page = first_page
+    total_post_count = (first_page - 1) * POSTS_PER_PAGE
+    pages = iter_pages_async(thread_url, thread_page_url, "messages", limiter, max_pages, first_page,
+                             predicted_pages(replies, first_page, max_pages))
+    try:
+        async with aclosing(pages):
+            # Pages come in order, so post numbers follow on from one page to the next
+            async for parsed in pages:
+                if not parsed["post_count"]:
+                    print(f"No posts found on page {page} of {thread_url}")
+                    break
+                for message in parsed["messages"]:
+                    message["post_number"] += total_post_count
+                yield parsed["messages"]
+                total_post_count += parsed["post_count"]
+                page += 1
+    except Exception as e:
+        print(f"Error scraping page {page} of thread {thread_url}: {e}")
+        raise
+
+async def crawl_async(writer, concurrency=CRAWL_CONCURRENCY):
+    """Crawl forums, thread lists and threads as a pipeline of stages.
+
+    Stages are linked by bounded queues so thread lists and threads of many
+    forums are fetched at the same time. A single writer stage saves to the
+    database, in the order items were queued (forum, then its threads, then
+    their messages, then the stats of each thread scraped in full).
+    """
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+    # Database work, commits and dictionary training included, runs in a thread
+    # of its own so it doesn't hold up the event loop
+    db_thread = ThreadPoolExecutor(max_workers=1)
+    limiter = asyncio.Semaphore(concurrency)
+    states = await loop.run_in_executor(db_thread, writer.thread_states) if INCREMENTAL else {}
+    # Threads listed so far, so threads listed in several places are only crawled once
+    seen = set()
+
+    forum_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    thread_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    write_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    async def list_threads():
+        while True:
+            forum = await forum_queue.get()
+            try:
+                threads = await get_threads_async(forum["url"], limiter, seen=seen)
+                print(f"Found {len(threads)} threads in forum: {forum['title']}")
+                for thread in threads:
+                    await write_queue.put(("thread", forum, thread))
+                    state = states.get(thread["url"])
+                    resume = resume_point(thread, state) if state else (1, 0)
+                    if resume is None:
+                        print(f"  No new posts in thread: {thread['title']}")
+                        continue
+                    await thread_queue.put((thread, resume))
+            except Exception as e:
+                metrics.count("scrape_errors")
+                print(f"Error scraping threads of forum {forum['url']}: {e}")
+            finally:
+                forum_queue.task_done()
+
+    async def scrape_messages():
+        while True:
+            thread, (first_page, last_post_number) = await thread_queue.get()
+            pages = iter_messages_async(thread["url"], limiter, first_page=first_page, replies=thread["replies"])
+            try:
+                # Pages go to the writer as they come in, so a long thread isn't held in memory
+                async with aclosing(pages):
+                    async for messages in pages:
+                        messages = [m for m in messages if m["post_number"] > last_post_number]
+                        await write_queue.put(("messages", thread, messages))
+                await write_queue.put(("scraped", thread, None))
+            except Exception:
+                # Already reported; the pages queued before the error are kept
+                metrics.count("scrape_errors")
+            finally:
+                thread_queue.task_done()
+
+    forum_ids = {}
+    thread_ids = {}
+
+    def save_item(kind, parent, item):
+        if kind == "forum":
+            forum_ids[item["url"]] = writer.save_forum(item)
+        elif kind == "thread" and item["url"] in states:
+            thread_ids[item["url"]] = states[item["url"]]["id"]
+            writer.update_thread(thread_ids[item["url"]], item, forum_ids[parent["url"]])
+        elif kind == "thread":
+            thread_ids[item["url"]] = writer.save_thread(item, forum_ids[parent["url"]])
+        elif kind == "scraped":
+            writer.save_thread_stats(thread_ids[parent["url"]], parent)
+        else:
+            writer.save_messages(item, thread_ids[parent["url"]])
+            print(f"  Saved {len(item)} messages of thread: {parent['title']}")
+
+    async def write():
+        while True:
+            kind, parent, item = await write_queue.get()
+            try:
+                await loop.run_in_executor(db_thread, save_item, kind, parent, item)
+            except Exception as e:
+                # Only this item is lost, the writer goes on with the next ones
+                metrics.count("scrape_errors")
+                url = item["url"] if kind in ("forum", "thread") else parent["url"]
+                print(f"Error saving {kind} of {url}: {e}")
+            finally:
+                write_queue.task_done()
+
+    workers = [asyncio.create_task(list_threads()) for _ in range(max(1, concurrency // 4))]
+    workers += [asyncio.create_task(scrape_messages()) for _ in range(concurrency)]
+    workers.append(asyncio.create_task(write()))
+
+    async with limiter:
+        forums = await asyncio.to_thread(get_forums)
+    print(f"Found {len(forums)} forums")
+    for forum in forums:
+        await write_queue.put(("forum", None, forum))
+        await forum_queue.put(forum)
+
+    # Each stage only receives work from the previous ones, so join them in order
+    await forum_queue.join()
+    await thread_queue.join()
+    await write_queue.join()
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    db_thread.shutdown()
+
+def save_listed_thread(writer, thread, forum_id, states):
+    """Save a thread from a forum's list, returning its ID and where to scrape it from.
+
+    The resume point is None when the thread has no new posts to scrape.
+    """
+    state = states.get(thread["url"])
+    if state:
+        # Known thread: keep its ID and only look for new posts
+        thread_id = state["id"]
+        writer.update_thread(thread_id, thread, forum_id)
+        resume = resume_point(thread, state)
+        if resume is None:
+            print(f"  No new posts, skipping thread with ID: {thread_id}")
+    else:
+        # Save thread to database
+        thread_id = writer.save_thread(thread, forum_id)
+        print(f"  Saved thread with ID: {thread_id}")
+        resume = (1, 0)
+    return thread_id, resume
+
+def crawl_forum(writer, forum, states, seen=None):
+    """Crawl the threads of a forum and their messages, leaving out the threads in seen"""
+    print(f"\nProcessing forum: {forum['title']}")
     
-print(session)
+    # Save forum to database
+    forum_id = writer.save_forum(forum)
+    print(f"Saved forum with ID: {forum_id}")
+
+    # Process each thread of this forum, as its list pages come in
+    threads = chain.from_iterable(iter_thread_pages(forum["url"], seen=seen))
+    for thread in threads:
+        print(f"  Processing thread: {thread['title']}")
+        thread_id, resume = save_listed_thread(writer, thread, forum_id, states)
+        if resume is None:
+            continue
+        first_page, last_post_number = resume
 
-if __name__ == "__main__":
-    # Initialize database
-    init_database()
+        # Get messages from this thread, saving each page as it comes in
+        try:
+            with profiled(thread["url"]):
+                saved = save_message_pages(writer, thread["url"], thread_id, first_page, last_post_number,
+                                           replies=thread["replies"])
+        except Exception:
+            # Already reported; the pages saved before the error are kept
+            metrics.count("scrape_errors")
+            continue
+        writer.save_thread_stats(thread_id, thread)
+        print(f"  Saved {saved} messages to database")
 
-    # Login first
-    login()
+def crawl(writer):
+    """Crawl forums, then threads, then messages one after another"""
+    states = writer.thread_states() if INCREMENTAL else {}
 
     # Get all forums
     forums = get_forums()
     print(f"Found {len(forums)} forums")
 
-    # Process each forum
+    # Process each forum, crawling threads listed in several places only once
+    seen = set()
+    for forum in forums:
+        with profiled(forum["url"]):
+            crawl_forum(writer, forum, states, seen)
+
+class CrawlBudget:
+    """Requests to the current site and time a crawl may use, from its creation"""
+
+    def __init__(self, max_requests=CRAWL_REQUEST_BUDGET, max_seconds=CRAWL_TIME_BUDGET):
+        self.max_requests = max_requests
+        self.max_seconds = max_seconds
+        self.started_at = time.monotonic()
+        # Other sites crawled at the same time don't use up this one's budget
+        self.site = current_site.get()
+        self.first_request = self.site.requests
+
+    def requests(self):
+        return self.site.requests - self.first_request
+
+    def exhausted(self):
+        return (self.max_requests is not None and self.requests() >= self.max_requests
+                or self.max_seconds is not None and time.monotonic() - self.started_at >= self.max_seconds)
+
+def thread_priority(thread, now):
+    """How hot a thread is: recent activity ranks first, old threads fade out"""
+    activity = (thread["replies"] or 0) + (thread["views"] or 0) / VIEWS_PER_REPLY
+    last_ts = parse_forum_date(thread["last_date"], now)
+    age_hours = max(now - last_ts, 0) / 3600 if last_ts is not None else 24 * 365 * 10
+    return (activity + 1) / (age_hours + 2) ** PRIORITY_GRAVITY
+
+def crawl_by_priority(writer):
+    """Read all thread lists, then crawl threads hottest first within the budget"""
+    budget = CrawlBudget()
+    states = writer.thread_states() if INCREMENTAL else {}
+    now = time.time()
+
+    forums = get_forums()
+    print(f"Found {len(forums)} forums")
+
+    # Thread lists first, to rank every thread with something to scrape
+    queue = []
+    seen = set()
     for forum in forums:
-        print(f"\nProcessing forum: {forum['title']}")
-        
-        # Save forum to database
-        forum_id = save_forum_to_db(forum)
-        print(f"Saved forum with ID: {forum_id}")
-
-        # Get threads from this forum
-        threads = get_threads(forum["url"])
-        print(f"Found {len(threads)} threads")
-
-        # Process each thread
-        for thread in threads:
-            print(f"  Processing thread: {thread['title']}")
-            
-            # Save thread to database
-            thread_id = save_thread_to_db(thread, forum_id)
-            print(f"  Saved thread with ID: {thread_id}")
-
-            # Get messages from this thread
-            messages = get_messages(thread["url"])
-            print(f"  Found {len(messages)} messages")
-            
-            # Save each message to database
-            for message in messages:
-                save_message_to_db(message, thread_id)
-            
-            print(f"  Saved {len(messages)} messages to database")
-
-    print("\nScraping completed! All data saved to database.")
\ No newline at end of file
+        if budget.exhausted():
+            print("Crawl budget used up while reading thread lists")
+            break
+        print(f"\nListing forum: {forum['title']}")
+        forum_id = writer.save_forum(forum)
+        for thread in chain.from_iterable(iter_thread_pages(forum["url"], seen=seen)):
+            thread_id, resume = save_listed_thread(writer, thread, forum_id, states)
+            if resume is not None:
+                queue.append((thread_priority(thread, now), thread, thread_id, resume))
+    queue.sort(key=lambda entry: entry[0], reverse=True)
+    print(f"\n{len(queue)} threads to scrape")
+
+    for done, (priority, thread, thread_id, (first_page, last_post_number)) in enumerate(queue):
+        if budget.exhausted():
+            metrics.count("threads_left_by_budget", len(queue) - done)
+            print(f"Crawl budget used up after {budget.requests()} requests,"
+                  f" {len(queue) - done} threads left for the next run")
+            break
+        print(f"  Processing thread: {thread['title']} (priority {priority:.3g})")
+        try:
+            with profiled(thread["url"]):
+                saved = save_message_pages(writer, thread["url"], thread_id, first_page, last_post_number,
+                                           replies=thread["replies"])
+        except Exception:
+            # Already reported; the pages saved before the error are kept
+            metrics.count("scrape_errors")
+            continue
+        # Threads left by the budget keep their old stats, to be scraped next time
+        writer.save_thread_stats(thread_id, thread)
+        print(f"  Saved {saved} messages to database")
+
+def crawl_frontier_item(writer, frontier, item, states):
+    """Crawl the forum index, a forum's thread list or a thread taken from the frontier"""
+    if item["kind"] == "index":
+        forums = get_forums()
+        print(f"Found {len(forums)} forums")
+        for forum in forums:
+            writer.save_forum(forum)
+            frontier.enqueue("forum", forum["url"])
+
+    elif item["kind"] == "forum":
+        forum_id = writer.forum_id(item["url"])
+        print(f"\nProcessing forum: {item['url']}")
+
+        for threads in iter_thread_pages(item["url"]):
+            for thread in threads:
+                # Threads saved before an interruption keep their ID and messages
+                thread_id = writer.thread_id(thread["url"])
+                if thread_id:
+                    writer.update_thread(thread_id, thread, forum_id)
+                else:
+                    thread_id = writer.save_thread(thread, forum_id)
+                # Thread items predict their pages from the stored reply count;
+                # resume_point takes back threads whose posts fall short of it
+                writer.save_thread_stats(thread_id, thread)
+
+                state = states.get(thread["url"])
+                resume = resume_point(thread, state) if state else (1, 0)
+                if resume is not None:
+                    frontier.enqueue("thread", thread["url"], *resume)
+            frontier.renew(item)
+
+    else:
+        # A failed page fails the item, to be retried (stored posts are skipped)
+        thread_id = writer.thread_id(item["url"])
+        saved = save_message_pages(writer, item["url"], thread_id,
+                                   item["first_page"], item["last_post_number"],
+                                   on_page=lambda: frontier.renew(item),
+                                   replies=writer.thread_replies(thread_id))
+        print(f"  Saved {saved} messages of thread: {item['url']}")
+
+def crawl_frontier(writer, worker_id=None):
+    """Crawl through the persistent frontier, resuming an interrupted crawl if any"""
+    frontier = CrawlFrontier(writer, worker_id)
+    states = writer.thread_states() if INCREMENTAL else {}
+
+    # Alone on the frontier, items left in flight were ours: take them back
+    # now. Distributed workers wait for the leases of those items to expire.
+    if not DISTRIBUTED:
+        frontier.reset_in_flight()
+    if frontier.start_crawl():
+        print("Starting a new crawl")
+    else:
+        print(f"Resuming crawl, {frontier.remaining()} items left")
+
+    while True:
+        item = frontier.claim()
+        if item is None:
+            if not frontier.remaining():
+                break
+            # Other workers still hold items, which may queue more work or expire
+            time.sleep(WORKER_POLL_INTERVAL)
+            continue
+
+        try:
+            with profiled(item["url"]):
+                crawl_frontier_item(writer, frontier, item, states)
+            frontier.done(item)
+
+        except Exception as e:
+            metrics.count("frontier_retries")
+            print(f"Error crawling {item['kind']} {item['url']} (attempt {item['attempts'] + 1}): {e}")
+            frontier.retry(item)
+
+def crawl_worker(number):
+    """Distributed crawl worker process, started by fork from the logged-in parent"""
+    global page_cache
+    # Connections, locks and threads of the parent can't be shared after fork
+    site = current_site.get()
+    mount_adapters(site.session)
+    site.login_lock = threading.Lock()
+    host_throttles.clear()
+    if page_cache is not None:
+        page_cache = PageCache()
+    metrics.reset()
+
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    metrics_file = f"{os.path.splitext(METRICS_FILE)[0]}-{number}{os.path.splitext(METRICS_FILE)[1]}"
+    metrics.start_dumper(metrics_file)
+    # Commit each page straight away, so other workers aren't kept waiting
+    with DatabaseWriter(site.db_name, commit_interval=0) as writer:
+        crawl_frontier(writer, worker_id)
+    metrics.stop(metrics_file)
+    print(f"Worker {worker_id} finished")
+    metrics.print_summary()
+
+def run_workers():
+    """Run WORKERS distributed crawl workers and wait for them"""
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=crawl_worker, args=(number,)) for number in range(WORKERS)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+def run_crawl(writer):
+    """Crawl the current site into writer, in the configured mode"""
+    if RESUMABLE_CRAWL:
+        crawl_frontier(writer)
+    elif ASYNC_CRAWL:
+        asyncio.run(crawl_async(writer))
+    elif PRIORITY_CRAWL:
+        crawl_by_priority(writer)
+    else:
+        crawl(writer)
+
+def crawl_site(site):
+    """Log in to a site and crawl it, in a thread of its own"""
+    current_site.set(site)
+    try:
+        if not REPLAY_MODE:
+            restore_session()
+        with DatabaseWriter(site.db_name) as writer:
+            run_crawl(writer)
+        print(f"Finished crawling {site.name}")
+    except Exception as e:
+        metrics.count("site_errors")
+        print(f"Error crawling {site.name}: {e}")
+
+def run_sites(sites):
+    """Crawl several sites concurrently, one thread each"""
+    threads = [threading.Thread(target=crawl_site, args=(site,), name=site.name) for site in sites]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+print(session)
+
+if __name__ == "__main__":
+    if SITES:
+        if DISTRIBUTED:
+            raise SystemExit("DISTRIBUTED crawls a single site, run one distributed crawl per site")
+        sites = [Site(**config) for config in SITES]
+
+        # Initialize databases
+        db_names = list(dict.fromkeys(site.db_name for site in sites))
+        if REPLAY_MODE:
+            for db_name in db_names:
+                check_replay_database(db_name)
+        for db_name in db_names:
+            init_database(db_name)
+
+        # Each site logs in and crawls in its own thread
+        metrics.start_dumper()
+        run_sites(sites)
+    else:
+        # Initialize database
+        if REPLAY_MODE:
+            check_replay_database()
+        init_database()
+
+        # Login first (not needed when pages come from the cache)
+        if not REPLAY_MODE:
+            restore_session()
+
+        if DISTRIBUTED:
+            run_workers()
+        else:
+            metrics.start_dumper()
+
+            with DatabaseWriter() as writer:
+                run_crawl(writer)
+
+    if not DISTRIBUTED:
+        if parse_pool is not None:
+            parse_pool.shutdown()
+
+        metrics.stop()
+        metrics.print_summary()
+
+    print("\nScraping completed! All data saved to database.")
@@ -0,0 +1,218 @@
+"""Compressed storage of message content with a trained shared dictionary.
+
+Forum posts repeat signatures, quotes and boilerplate, which compress poorly
+one message at a time but very well with a dictionary trained on the archive.
+Compressed messages keep their content in messages.content as a BLOB, and
+messages.content_dict_id points to the content_dicts row needed to read it;
+content of rows with no dictionary is plain text.
+
+zstandard is used when installed, zlib with a preset dictionary otherwise.
+
+Compress an existing database, or turn it back to plain text:
+
+    python message_codec.py compress forum_data.db
+    python message_codec.py decompress forum_data.db
+"""
+import collections
+import sqlite3
+import sys
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DICT_SIZE = 64 * 1024           # zlib only uses the last 32 KB
+DICT_SAMPLE_MESSAGES = 5000     # messages the dictionary is trained on
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 9
+
+# zlib dictionary training: fragments of FRAGMENT_LENGTH characters are taken
+# every FRAGMENT_STEP characters, and those found in several messages are kept
+FRAGMENT_LENGTH = 32
+FRAGMENT_STEP = 8
+
+
+def default_codec():
+    return "zstd" if zstandard is not None else "zlib"
+
+
+def train_zlib_dictionary(samples, size=DICT_SIZE):
+    """Dictionary of the fragments shared by most samples.
+
+    zlib matches against the end of the dictionary more cheaply, so the most
+    common fragments go last.
+    """
+    counts = collections.Counter()
+    for sample in samples:
+        counts.update({
+            sample[i:i + FRAGMENT_LENGTH]
+            for i in range(0, max(len(sample) - FRAGMENT_LENGTH, 0) + 1, FRAGMENT_STEP)
+        })
+
+    fragments = []
+    total = 0
+    for fragment, count in counts.most_common():
+        if count < 2 or total >= size:
+            break
+        fragment = fragment.encode("utf-8")
+        fragments.append(fragment)
+        total += len(fragment)
+    return b"".join(reversed(fragments))[-size:]
+
+
+def train_dictionary(samples, codec=None, size=DICT_SIZE):
+    """Train a dictionary for codec on sample message contents"""
+    codec = codec or default_codec()
+    if codec == "zstd":
+        try:
+            data = zstandard.train_dictionary(size, [sample.encode("utf-8") for sample in samples])
+            return codec, data.as_bytes()
+        except zstandard.ZstdError as e:
+            # Too few or too small samples for zstd's trainer
+            print(f"zstd dictionary training failed ({e}), using zlib")
+    return "zlib", train_zlib_dictionary(samples, size)
+
+
+class MessageCodec:
+    """Compresses and decompresses message contents with one dictionary"""
+
+    def __init__(self, codec, data, dict_id=None):
+        self.codec = codec
+        self.data = data
+        self.dict_id = dict_id
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("Messages were compressed with zstd: pip install zstandard")
+            dictionary = zstandard.ZstdCompressionDict(data)
+            self.compressor = zstandard.ZstdCompressor(
+                level=ZSTD_LEVEL, dict_data=dictionary, write_content_size=True
+            )
+            self.decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+        elif codec == "zlib":
+            # Loading the dictionary is the costly part: copy primed objects instead
+            self.compressor = zlib.compressobj(ZLIB_LEVEL, zdict=data)
+            self.decompressor = zlib.decompressobj(zdict=data)
+        else:
+            raise ValueError(f"Unknown content codec: {codec}")
+
+    def compress(self, content):
+        raw = content.encode("utf-8")
+        if self.codec == "zstd":
+            return self.compressor.compress(raw)
+        compressor = self.compressor.copy()
+        return compressor.compress(raw) + compressor.flush()
+
+    def decompress(self, blob):
+        if self.codec == "zstd":
+            raw = self.decompressor.decompress(blob)
+        else:
+            decompressor = self.decompressor.copy()
+            raw = decompressor.decompress(blob) + decompressor.flush()
+        return raw.decode("utf-8")
+
+
+def load_codec(conn, dict_id=None):
+    """Codec of a stored dictionary, the latest one by default, or None if there is none"""
+    if dict_id is None:
+        row = conn.execute("SELECT id, codec, data FROM content_dicts ORDER BY id DESC LIMIT 1").fetchone()
+    else:
+        row = conn.execute("SELECT id, codec, data FROM content_dicts WHERE id = ?", (dict_id,)).fetchone()
+    if row is None:
+        return None
+    dict_id, codec, data = row
+    return MessageCodec(codec, data, dict_id)
+
+
+def sample_contents(conn, limit=DICT_SAMPLE_MESSAGES):
+    """Plain contents of messages spread over the whole archive"""
+    count = conn.execute("SELECT COUNT(*) FROM messages WHERE content_dict_id IS NULL").fetchone()[0]
+    step = max(count // limit, 1)
+    cursor = conn.execute('''
+        SELECT content FROM messages
+        WHERE content_dict_id IS NULL AND content != '' AND id % ? = 0
+        LIMIT ?
+    ''', (step, limit))
+    return [content for content, in cursor]
+
+
+def create_codec(conn, codec=None, sample_size=DICT_SAMPLE_MESSAGES, min_samples=1):
+    """Train and store a dictionary on up to sample_size stored messages.
+
+    Returns None while fewer than min_samples messages can be sampled.
+    """
+    samples = sample_contents(conn, sample_size)
+    if len(samples) < min_samples:
+        return None
+    codec, data = train_dictionary(samples, codec)
+    cursor = conn.execute(
+        "INSERT INTO content_dicts (codec, data, created_at) VALUES (?, ?, ?)",
+        (codec, data, time.time()),
+    )
+    return MessageCodec(codec, data, cursor.lastrowid)
+
+
+class MessageDecoder:
+    """Reads message contents whatever dictionary they were stored with"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.codecs = {}
+
+    def decode(self, content, dict_id):
+        if dict_id is None:
+            return content
+        if dict_id not in self.codecs:
+            self.codecs[dict_id] = load_codec(self.conn, dict_id)
+        return self.codecs[dict_id].decompress(content)
+
+
+def recompress(conn, codec, batch_size=1000):
+    """Store every message with codec, or as plain text if codec is None.
+
+    Returns the number of messages rewritten.
+    """
+    decoder = MessageDecoder(conn)
+    target = codec.dict_id if codec else None
+    rewritten = 0
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, content, content_dict_id FROM messages
+            WHERE id > ? AND content_dict_id IS NOT ?
+            ORDER BY id LIMIT ?
+        ''', (last_id, target, batch_size)).fetchall()
+        if not rows:
+            return rewritten
+        updates = []
+        for message_id, content, dict_id in rows:
+            content = decoder.decode(content, dict_id)
+            updates.append((codec.compress(content) if codec else content, target, message_id))
+        conn.executemany("UPDATE messages SET content = ?, content_dict_id = ? WHERE id = ?", updates)
+        conn.commit()
+        rewritten += len(rows)
+        last_id = rows[-1][0]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("compress", "decompress"):
+        raise SystemExit(__doc__)
+    db_path = sys.argv[2] if len(sys.argv) > 2 else "forum_data.db"
+    conn = sqlite3.connect(db_path)
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'content_dicts'").fetchone():
+        raise SystemExit(f"{db_path} predates compressed content, run the scraper on it once to upgrade it")
+
+    if sys.argv[1] == "compress":
+        codec = create_codec(conn)
+        if codec is None:
+            raise SystemExit("No messages to train a dictionary on")
+        print(f"Trained a {codec.codec} dictionary of {len(codec.data)} bytes")
+    else:
+        codec = None
+    print(f"Rewrote {recompress(conn, codec)} messages")
+
+    # Give the freed pages back to the filesystem
+    conn.execute("VACUUM")
+    conn.close()